@@ -2,67 +2,128 @@
 # Tells the operating system to use Python 3 to run this script.
 
 import os                    # Provides functions for interacting with the operating system.
+import functools             # Provides lru_cache to memoize the wavelet kernel between products.
 import glob                  # Helps find files matching specified patterns (e.g., "*.csv").
-import re                    # Provides support for regular expressions for pattern matching.
 import pandas as pd          # Used for data manipulation and analysis (DataFrames).
 import numpy as np           # Provides support for numerical operations and arrays.
+import matplotlib            # Plotting library; the non-interactive 'Agg' backend is selected below.
+matplotlib.use('Agg')        # Render straight to image files (no GUI), which is also safe in worker processes.
 import matplotlib.pyplot as plt  # Used for creating plots and visualizations.
+from concurrent.futures import ProcessPoolExecutor  # Runs the per-product diagrams in parallel worker processes.
+import scipy.fft             # Multithreaded FFTs (pocketfft) used by the wavelet transform.
 import pywt                  # PyWavelets library: used to perform wavelet transforms (analyzing signals in time and frequency).
+# CSV reader (pyarrow engine when available, C engine otherwise) and the file name rule shared by the pipeline.
+from normalization import read_csv_file, sanitize_filename
 
 # Global parameters for wavelet analysis:
 wavelet_name = 'cmor1.5-1.0'   # Name of the wavelet to use (here, a complex Morlet wavelet with specific parameters).
-scales = np.arange(1, 128)     # Array of scales for the continuous wavelet transform (CWT); scales affect time-frequency resolution.
-sampling_period = 1            # Sampling period of the data (e.g., 1 if data is daily or 1/12 if data is monthly).
+# Array of scales for the continuous wavelet transform (CWT); scales affect time-frequency resolution.
+# 40 scales evenly spaced in log2 from 1 to 127 match the log2 y-axis of the scalogram (every row has the
+# same height) and need about a third of the work of the linear grid 1, 2, ..., 127.
+scales = np.logspace(0, np.log2(127), 40, base=2)
+
+# Threads used by each FFT in the CWT (-1 = all CPU cores). This applies to single-process runs; the worker
+# processes of generate_diagrams use one thread each, since the pool already keeps every core busy.
+fft_workers = -1
+
+# Output image settings:
+diagram_dpi = 100              # Resolution of the saved diagrams (PNG size and encoding time grow with dpi squared).
+# Extra savefig arguments per image format; webp and jpg are encoded by Pillow with fast, lossy settings.
+image_save_options = {
+    'png': {},
+    'webp': {'pil_kwargs': {'quality': 85, 'method': 0}},
+    'jpg': {'pil_kwargs': {'quality': 85}},
+}
 
 # ---------------------------------------------------------------------
-# Function: sanitize_filename
+# Function: morlet_kernel
 # ---------------------------------------------------------------------
-def sanitize_filename(file_name):
+@functools.lru_cache(maxsize=8)
+def morlet_kernel(fft_length):
     """
-    Replace characters that are forbidden in file names (\, /, :, *, ?, ", <, >, |)
-    with an underscore. This ensures the filename is valid for Windows.
-    
+    Fourier transform of the complex Morlet wavelet 'cmorB-C' on the global scale grid.
+
+    The kernel only depends on the module-level wavelet parameters and the FFT length,
+    so it is computed once per FFT length and reused for every product and file.
+
     Parameters:
-      file_name (str): The original file name.
-    
+      fft_length (int): Length of the (zero-padded) FFT the kernel will be multiplied with.
+
     Returns:
-      str: A sanitized file name safe for saving.
+      ndarray: float32 array with shape (len(scales), fft_length), including the sqrt(scale) energy normalization.
     """
-    # Replace any forbidden character with an underscore.
-    return re.sub(r'[\\/:*?"<>|]+', '_', str(file_name))
+    # Angular frequencies (radians per sample) of the FFT bins.
+    omega = 2 * np.pi * np.fft.fftfreq(fft_length)
+    # Evaluate the wavelet's Fourier transform at scale * omega for every scale (rows) and frequency (columns).
+    wavelet = pywt.ContinuousWavelet(wavelet_name)
+    bandwidth, center = wavelet.bandwidth_frequency, wavelet.center_frequency
+    scaled_omega = scales[:, None] * omega[None, :]
+    kernel = np.sqrt(scales)[:, None] * np.exp(-bandwidth * (scaled_omega - 2 * np.pi * center) ** 2 / 4)
+    # The kernel is real, so a float32 copy keeps the product with a complex64 spectrum in single precision.
+    return kernel.astype(np.float32)
 
 # ---------------------------------------------------------------------
-# Function: generate_wavelet_diagram
+# Function: fft_cwt
 # ---------------------------------------------------------------------
-def generate_wavelet_diagram(data_frame, product_name, output_file_path):
+def fft_cwt(signal_values):
     """
-    Generate and save a wavelet scalogram diagram for a product's time series data.
-    
-    This function:
-      - Sorts the data by date and removes missing values.
-      - Extracts the time series (dates and values).
-      - Computes the Continuous Wavelet Transform (CWT) of the time series using a chosen wavelet.
-      - Converts the wavelet power to a logarithmic scale for better visualization.
-      - Creates a figure with:
-          * A plot of the original time series.
-          * A scalogram (contour plot of the wavelet power vs. time and scale).
-          * A color bar indicating the log10 wavelet power.
-      - Saves the figure as a PNG file.
-    
+    Compute the Continuous Wavelet Transform (CWT) of a signal for every scale at once using the FFT.
+
+    Instead of convolving the signal with each scaled wavelet in the time domain (as pywt.cwt does),
+    the signal is transformed once, multiplied by the cached Fourier transform of the complex Morlet
+    wavelet on the whole scale grid, and transformed back along the frequency axis.
+    The result matches pywt.cwt(signal_values, scales, wavelet_name) up to discretization error.
+
     Parameters:
-      data_frame (DataFrame): Contains the time series data with at least 'Date' and 'Value' columns.
-      product_name (str): The product name, used for labeling the diagram.
-      output_file_path (str): The full path (including file name) where the diagram will be saved.
+      signal_values (ndarray): The 1-D time series to analyze.
+
+    Returns:
+      ndarray: Complex CWT coefficients with shape (len(scales), len(signal_values)).
     """
-    # Sort data by the 'Date' column and drop rows where 'Value' is missing.
-    data_frame = data_frame.sort_values('Date').dropna(subset=['Value'])
-    time_axis = data_frame['Date']              # X-axis: dates.
-    signal_values = data_frame['Value'].values    # Y-axis: numeric values of the time series.
-
-    # Create a new figure with a specified size.
-    figure = plt.figure(figsize=(14, 10))
-    # Set the main title of the figure, including the product name.
-    figure.suptitle(f"Wavelet Scalogram - Product: {product_name}", fontsize=16)
+    signal_length = len(signal_values)
+    # Zero-pad to a power of two of at least twice the signal length, so that the circular
+    # convolution of the FFT does not wrap the end of the signal onto its start.
+    # Powers of two also keep the number of distinct cached kernels small.
+    fft_length = 1 << (2 * signal_length - 1).bit_length()
+
+    # One forward FFT of the signal, one inverse FFT for all scales, then trim the padding.
+    # scipy.fft spreads the rows of the inverse transform over 'fft_workers' threads, and the
+    # product array is a temporary, so the inverse transform may overwrite it instead of allocating.
+    signal_fft = scipy.fft.fft(signal_values, fft_length, workers=fft_workers)
+    return scipy.fft.ifft(signal_fft[None, :] * morlet_kernel(fft_length), axis=1,
+                          workers=fft_workers, overwrite_x=True)[:, :signal_length]
+
+# ---------------------------------------------------------------------
+# Function: use_single_fft_thread
+# ---------------------------------------------------------------------
+def use_single_fft_thread():
+    """
+    Initializer of the generate_diagrams worker processes: every worker already renders one diagram
+    per CPU core, so its FFTs run in a single thread (one thread per core per worker would
+    oversubscribe the CPU).
+    """
+    global fft_workers
+    fft_workers = 1
+
+# ---------------------------------------------------------------------
+# Function: create_diagram_figure
+# ---------------------------------------------------------------------
+# The figure, its axes and the artists that are reused for every diagram drawn by this process.
+# It is created on first use (so each worker process builds its own) and never closed.
+diagram_figure = None
+
+def create_diagram_figure():
+    """
+    Build the wavelet diagram figure once: the time series axes, the scalogram axes,
+    the colorbar axes and an (empty) time series line.
+    
+    Returns:
+      dict: The figure and its reusable parts ('figure', 'ax_time_series', 'ax_scalogram',
+            'ax_colorbar', 'time_series_line'), plus slots for the current 'scalogram_mesh' and 'colorbar'.
+    """
+    # Create a new figure with a specified size. The constrained layout engine keeps the
+    # elements from overlapping and is re-solved while saving, as tick labels change per product.
+    figure = plt.figure(figsize=(14, 10), layout='constrained')
 
     # Create a grid layout for subplots:
     # - 2 rows and 2 columns.
@@ -76,99 +137,224 @@ def generate_wavelet_diagram(data_frame, product_name, output_file_path):
     # Subplot for the colorbar on the right, spanning both rows.
     ax_colorbar = figure.add_subplot(grid_spec[:, 1])
 
-    # Plot the time series data in blue.
-    ax_time_series.plot(time_axis, signal_values, color='blue', linewidth=2)
+    # The time series is drawn as a blue line whose data is replaced for every product.
+    time_series_line, = ax_time_series.plot([], [], color='blue', linewidth=2)
+    ax_time_series.xaxis_date()  # The x-axis shows dates.
     ax_time_series.set(title='Time Series', ylabel='Value')
     ax_time_series.grid(True)  # Add gridlines for easier reading.
+    ax_scalogram.set(title='Scalogram (CWT)', xlabel='Date', ylabel='Scale (log2)')
+
+    return {
+        'figure': figure,
+        'ax_time_series': ax_time_series,
+        'ax_scalogram': ax_scalogram,
+        'ax_colorbar': ax_colorbar,
+        'time_series_line': time_series_line,
+        'scalogram_mesh': None,
+        'colorbar': None,
+    }
+
+# ---------------------------------------------------------------------
+# Function: generate_wavelet_diagram
+# ---------------------------------------------------------------------
+def generate_wavelet_diagram(dates, values, product_name, output_file_path):
+    """
+    Generate and save a wavelet scalogram diagram for a product's time series data.
+    
+    This function:
+      - Removes missing values from the (date-sorted) time series.
+      - Computes the Continuous Wavelet Transform (CWT) of the time series using a chosen wavelet.
+      - Converts the wavelet power to a logarithmic scale for better visualization.
+      - Fills the (reused) figure with:
+          * A plot of the original time series.
+          * A scalogram (color mesh of the wavelet power vs. time and scale).
+          * A color bar indicating the log10 wavelet power.
+      - Saves the figure as an image (the format follows the extension of 'output_file_path').
+    
+    Parameters:
+      dates (ndarray): The product's dates, sorted in ascending order.
+      values (ndarray): The product's values, aligned with 'dates' (may contain NaN).
+      product_name (str): The product name, used for labeling the diagram.
+      output_file_path (str): The full path (including file name) where the diagram will be saved.
+    """
+    global diagram_figure
+    # Drop the points where the value is missing with a single boolean mask.
+    has_value = ~np.isnan(values)
+    time_axis = dates[has_value]                # X-axis: dates.
+    # Y-axis: numeric values of the time series. Single precision is plenty for a diagram saved at
+    # 'diagram_dpi' and halves the memory traffic of the CWT (float32 in, complex64 coefficients out).
+    signal_values = values[has_value].astype(np.float32, copy=False)
+
+    # Build the figure on the first call only; later calls just swap the data in.
+    if diagram_figure is None:
+        diagram_figure = create_diagram_figure()
+    figure = diagram_figure['figure']
+    ax_time_series = diagram_figure['ax_time_series']
+    ax_scalogram = diagram_figure['ax_scalogram']
+
+    # Set the main title of the figure, including the product name (replaces the previous title).
+    figure.suptitle(f"Wavelet Scalogram - Product: {product_name}", fontsize=16)
+
+    # Replace the time series data and rescale the y-axis to it.
+    diagram_figure['time_series_line'].set_data(time_axis, signal_values)
+    ax_time_series.relim()
+    ax_time_series.autoscale_view(scalex=False)
 
     # ---------------------------------------------------------------------
     # Compute the Continuous Wavelet Transform (CWT):
     # - The CWT decomposes the time series into time-frequency space.
-    # - 'pywt.cwt' returns coefficients representing how much a wavelet (scaled version of a function)
-    #   matches the data at each scale and time.
+    # - 'fft_cwt' returns coefficients representing how much a wavelet (scaled version of a function)
+    #   matches the data at each scale and time, computed for all scales with a single pair of FFTs.
     # - Here we compute the power (magnitude squared) of these coefficients.
     # - To better visualize the range of power values, we take the logarithm (base 10) of the power.
     # ---------------------------------------------------------------------
-    cwt_coefficients, _ = pywt.cwt(signal_values, scales, wavelet_name, sampling_period=sampling_period)
-    wavelet_power = np.abs(cwt_coefficients) ** 2  # Compute power from coefficients.
-    # Replace any zeros with a very small number to avoid issues when taking the logarithm.
-    wavelet_power[wavelet_power == 0] = 1e-6
-    log_wavelet_power = np.log10(wavelet_power)
+    cwt_coefficients = fft_cwt(signal_values)
+    # Compute power from coefficients as real^2 + imag^2: this skips the square root of np.abs and its
+    # temporary array, and the sum is written straight into a single output buffer.
+    coefficients_real, coefficients_imag = cwt_coefficients.real, cwt_coefficients.imag
+    wavelet_power = np.square(coefficients_real)
+    wavelet_power += np.square(coefficients_imag)
+    # Clamp the power to a tiny floor so zeros never reach the logarithm, then take log10.
+    # Both steps write into the same buffer: no boolean mask and no extra (scales x time) array.
+    log_wavelet_power = np.log10(np.maximum(wavelet_power, 1e-12, out=wavelet_power), out=wavelet_power)
 
-    # Create a contour plot (scalogram) of the log-transformed wavelet power.
+    # Draw the scalogram of the log-transformed wavelet power as a color mesh (one cell per time/scale pair).
     # - X-axis: time.
     # - Y-axis: log2 of the scales (provides a more uniform display of scales).
-    # - 100 contour levels with the 'viridis' color map.
-    contour_plot = ax_scalogram.contourf(
+    # - 'viridis' color map.
+    # A mesh is drawn directly as an image by Agg, which is far cheaper than tracing 100 filled contour
+    # levels, while still placing each cell at its true (possibly irregular) date and log2 scale.
+    # The mesh's grid size depends on the series length, so the previous product's mesh is replaced.
+    if diagram_figure['scalogram_mesh'] is not None:
+        diagram_figure['scalogram_mesh'].remove()
+    scalogram_mesh = ax_scalogram.pcolormesh(
         time_axis,                     # X-axis values (time).
         np.log2(scales),               # Y-axis values: log2 of scales.
-        log_wavelet_power,             # Z-axis values: log10 of wavelet power.
-        100,                           # Number of contour levels.
+        log_wavelet_power,             # Color values: log10 of wavelet power.
+        shading='nearest',             # Center each cell on its (time, scale) sample.
         cmap='viridis'                 # Color map for visualization.
     )
-    ax_scalogram.set(title='Scalogram (CWT)', xlabel='Date', ylabel='Scale (log2)')
-    ax_scalogram.grid(True)  # Enable grid lines.
+    diagram_figure['scalogram_mesh'] = scalogram_mesh
+    # Fit both axes to the new mesh (autoscaling would still include the previous product's extent).
+    mesh_coordinates = scalogram_mesh.get_coordinates()
+    ax_scalogram.set_xlim(mesh_coordinates[..., 0].min(), mesh_coordinates[..., 0].max())
+    ax_scalogram.set_ylim(mesh_coordinates[..., 1].min(), mesh_coordinates[..., 1].max())
+    ax_scalogram.grid(True)  # Enable grid lines (drawn above the mesh).
 
-    # Add a colorbar to the right of the scalogram indicating the log10 wavelet power.
-    figure.colorbar(contour_plot, cax=ax_colorbar, label='Log10 Wavelet Power')
+    # Add a colorbar to the right of the scalogram indicating the log10 wavelet power,
+    # or point the existing colorbar at the new mesh and its color range.
+    if diagram_figure['colorbar'] is None:
+        diagram_figure['colorbar'] = figure.colorbar(scalogram_mesh, cax=diagram_figure['ax_colorbar'],
+                                                     label='Log10 Wavelet Power')
+    else:
+        diagram_figure['colorbar'].update_normal(scalogram_mesh)
 
-    # Adjust the layout to prevent overlapping elements.
-    plt.tight_layout()
-    # Save the entire figure (time series + scalogram) to the specified output file.
-    figure.savefig(output_file_path, dpi=150)
-    plt.close(figure)  # Close the figure to free up memory.
+    # Save the entire figure (time series + scalogram) to the specified output file,
+    # with the encoder settings that belong to its image format.
+    # The figure stays open and is reused for the next product handled by this process.
+    image_format = os.path.splitext(output_file_path)[1].lstrip('.').lower()
+    figure.savefig(output_file_path, dpi=diagram_dpi, **image_save_options.get(image_format, {}))
 
 # ---------------------------------------------------------------------
 # Function: generate_diagrams
 # ---------------------------------------------------------------------
-def generate_diagrams(normalized_folder='normalized_files', diagrams_folder='diagrams'):
+def generate_diagrams(normalized_folder='normalized_files', diagrams_folder='diagrams', max_workers=None,
+                      image_format='png'):
     """
     For each normalized CSV file in the specified folder, generate wavelet scalogram diagrams for each product.
     
     Parameters:
-      normalized_folder (str): Directory containing normalized CSV files (with columns [Date, Product, Value]).
+      normalized_folder (str or dict): Directory containing normalized CSV files (with columns [Date, Product, Value]),
+        or a dict mapping base file names to normalized DataFrames (as returned by normalization.process_folder).
       diagrams_folder (str): Directory where the generated diagram images will be saved.
+      max_workers (int): Number of worker processes rendering diagrams in parallel (default: one per CPU core).
+      image_format (str): File format of the diagrams: 'png' (default), 'webp' or 'jpg' (smaller and faster to encode).
       
     This function:
       - Ensures the output directory exists.
       - Finds all normalized CSV files.
       - For each file, groups the data by product.
-      - For each product, generates and saves a wavelet diagram.
+      - For each product, generates and saves a wavelet diagram in a worker process.
       - Skips diagram generation if an output file already exists.
     """
     # Create the output directory for diagrams if it doesn't exist.
     if not os.path.exists(diagrams_folder):
         os.makedirs(diagrams_folder)
 
-    # Use glob to list all files ending with "_normalized.csv" in the normalized folder.
-    all_normalized_files = glob.glob(os.path.join(normalized_folder, '*_normalized.csv'))
-    if not all_normalized_files:
+    # Normalized DataFrames that are already in memory are used as they are. Otherwise use glob to list
+    # all files ending with "_normalized.csv" in the normalized folder.
+    # 'normalized_sources' maps each base file name to its DataFrame or CSV file.
+    if isinstance(normalized_folder, dict):
+        normalized_sources = normalized_folder
+    else:
+        normalized_sources = {os.path.splitext(os.path.basename(csv_file))[0]: csv_file
+                              for csv_file in glob.glob(os.path.join(normalized_folder, '*_normalized.csv'))}
+    if not normalized_sources:
         print(f"No normalized files found in '{normalized_folder}'.")
         return
 
-    # Loop through each normalized CSV file.
-    for csv_file in all_normalized_files:
-        print(f"\nGenerating wavelet diagrams from: {csv_file}")
-        # Read the CSV file into a DataFrame, parsing the 'Date' column as dates.
-        data_frame = pd.read_csv(csv_file, parse_dates=['Date'])
-        # Get the base name of the file (without directory and extension) for naming outputs.
-        base_file_name = os.path.splitext(os.path.basename(csv_file))[0]
-
-        # Group the data by the 'Product' column.
-        for product_name, product_df in data_frame.groupby('Product'):
-            # Sanitize the product name to create a safe file name.
-            safe_product_name = sanitize_filename(product_name)
-            # Construct the output file name.
-            output_file_name = f"{base_file_name}__{safe_product_name}.png"
-            output_file_path = os.path.join(diagrams_folder, output_file_name)
+    # Each product's diagram (CWT + rendering + PNG encoding) is independent and CPU-bound,
+    # so the diagrams are rendered concurrently in a pool of worker processes.
+    # 'pending_diagrams' maps each submitted job to the output file it will produce.
+    pending_diagrams = {}
+    # Each worker runs its FFTs in a single thread (use_single_fft_thread), as the workers already use every core.
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=use_single_fft_thread) as executor:
+        # Loop through each normalized DataFrame or CSV file (the base file name is used for naming outputs).
+        for base_file_name, normalized_source in normalized_sources.items():
+            in_memory = isinstance(normalized_source, pd.DataFrame)
+            print(f"\nGenerating wavelet diagrams from: {base_file_name if in_memory else normalized_source}")
 
             # --------------- SKIP CHECK ---------------
-            # If the diagram file already exists, skip generating it.
-            if os.path.exists(output_file_path):
-                print(f"   -> Diagram already exists, skipping: {output_file_path}")
+            # Read only the 'Product' column first and build the output path of every product's diagram.
+            # If all of them already exist, the dates and values are never parsed.
+            if in_memory:
+                products = normalized_source['Product'].dropna().unique()
+            else:
+                products = read_csv_file(normalized_source, usecols=['Product'],
+                                         dtype={'Product': 'string'})['Product'].dropna().unique()
+            # Construct the output file name from the sanitized (safe) product name.
+            output_file_paths = {
+                product_name: os.path.join(diagrams_folder, f"{base_file_name}__{sanitize_filename(product_name)}.{image_format}")
+                for product_name in products
+            }
+            if all(os.path.exists(output_file_path) for output_file_path in output_file_paths.values()):
+                print(f"   -> All {len(output_file_paths)} diagrams already exist, skipping file.")
                 continue
             # ------------------------------------------
 
-            # Generate the wavelet diagram for this product's data.
-            generate_wavelet_diagram(product_df, product_name, output_file_path)
+            # Read the CSV file into a DataFrame with the multithreaded pyarrow parser (the C parser without pyarrow),
+            # using explicit column types and parsing the 'Date' column as dates.
+            # An in-memory DataFrame already has these types.
+            if in_memory:
+                data_frame = normalized_source
+            else:
+                data_frame = read_csv_file(normalized_source, parse_dates=['Date'],
+                                           dtype={'Product': 'string', 'Value': 'float64'})
+            # Extract the two columns the diagrams need as plain NumPy arrays, once per file.
+            all_dates = data_frame['Date'].to_numpy()
+            all_values = data_frame['Value'].to_numpy(dtype=np.float32)
+            # Boolean mask of the rows that carry a value; missing values are dropped before sorting.
+            all_has_value = ~np.isnan(all_values)
+
+            # Group the rows by the 'Product' column. 'indices' maps each product to its row positions,
+            # so no per-product DataFrame has to be built (observed=True: only the products that have rows).
+            for product_name, row_positions in data_frame.groupby('Product', sort=False, observed=True).indices.items():
+                output_file_path = output_file_paths[product_name]
+
+                # If this product's diagram file already exists, skip generating it.
+                if os.path.exists(output_file_path):
+                    print(f"   -> Diagram already exists, skipping: {output_file_path}")
+                    continue
+
+                # Keep this product's rows that have a value, put them in date order and
+                # generate its diagram in a worker process. Only the two 1-D arrays are sent.
+                row_positions = row_positions[all_has_value[row_positions]]
+                row_positions = row_positions[np.argsort(all_dates[row_positions], kind='stable')]
+                job = executor.submit(generate_wavelet_diagram, all_dates[row_positions],
+                                      all_values[row_positions], product_name, output_file_path)
+                pending_diagrams[job] = output_file_path
+
+        # Wait for every diagram; result() re-raises any error that happened in a worker.
+        for job, output_file_path in pending_diagrams.items():
+            job.result()
             print(f"   -> Diagram saved: {output_file_path}")
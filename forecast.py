@@ -1,70 +1,81 @@
 #!/usr/bin/env python3
 
 import os                    # Operating system interfaces (e.g., file paths)
-import glob                  # Filename pattern matching (to find files)
-import re                    # Regular expression operations
+import hashlib               # Hashing of the training data (model cache keys)
+import json                  # Storage of the warm-start parameters
 import pandas as pd          # Data analysis library (for DataFrames)
 import numpy as np           # Numerical operations library
+import matplotlib            # Plotting library; the non-interactive 'Agg' backend is selected below
+matplotlib.use('Agg')        # Render straight to image files (no GUI), which is also safe in worker processes
 import matplotlib.pyplot as plt  # Plotting library
-from prophet import Prophet  # Forecasting library by Facebook
-from dateutil.parser import parse  # Date string parser
+from concurrent.futures import ProcessPoolExecutor  # Runs the per-product forecasts in parallel worker processes
+from prophet import Prophet, __version__ as prophet_version  # Forecasting library by Facebook
+from prophet.serialize import model_to_json, model_from_json  # Prophet's own model (de)serialization
+# CSV reader (pyarrow engine when available, C engine otherwise), and the Portuguese date parser and file name
+# rule shared by the pipeline
+from normalization import read_csv_file, parse_portuguese_dates, sanitize_filename
 
 # ---------------------------------------------------------------------
-# Function: parse_portuguese_date
+# Prophet model settings
 # ---------------------------------------------------------------------
-def parse_portuguese_date(date_string):
-    """
-    Convert a date string that may contain Portuguese month abbreviations
-    into a standard datetime object. If the conversion fails, return pd.NaT.
-    
-    Parameters:
-      date_string (str): The input date string (possibly with Portuguese abbreviations)
-    
-    Returns:
-      datetime or pd.NaT: The parsed date or a "Not a Time" value if parsing fails.
-    """
-    # Mapping of Portuguese month abbreviations to English abbreviations.
-    month_translation = {
-        'jan.': 'Jan', 'fev.': 'Feb', 'mar.': 'Mar', 'abr.': 'Apr',
-        'mai.': 'May', 'jun.': 'Jun', 'jul.': 'Jul', 'ago.': 'Aug',
-        'set.': 'Sep', 'out.': 'Oct', 'nov.': 'Nov', 'dez.': 'Dec',
-        'z.': 'Dec'
-    }
-    # Ensure the input is a string; if not, return "Not a Time".
-    if not isinstance(date_string, str):
-        return pd.NaT
-    # Replace any Portuguese month abbreviations with their English equivalents.
-    for pt_abbr, en_abbr in month_translation.items():
-        date_string = date_string.replace(pt_abbr, en_abbr)
-    try:
-        # Parse the date string using fuzzy parsing (ignoring unknown tokens).
-        return parse(date_string, fuzzy=True)
-    except:
-        return pd.NaT
+# These settings are shared by every product model. They are also part of the
+# model cache key, so changing them automatically refits the cached models.
+# - yearly seasonality enabled to capture annual trends
+# - weekly seasonality disabled
+# - increased prior scales for seasonality and trend flexibility
+prophet_settings = {
+    'weekly_seasonality': False,
+    'yearly_seasonality': True,
+    'seasonality_prior_scale': 15,   # Default is 10; increased for flexibility
+    'changepoint_prior_scale': 0.5,  # Default is 0.05; increased for more responsive trend changes
+    'mcmc_samples': 0,               # MAP fit only (the default), no full MCMC sampling
+    'uncertainty_samples': 0,        # Skip the uncertainty-interval simulation in predict(); the plots don't need it
+}
+# Custom monthly seasonality component to capture monthly fluctuations.
+monthly_seasonality = {
+    'name': 'monthly',
+    'period': 30.5,        # Approximately the number of days in a month
+    'fourier_order': 5,    # Number of Fourier terms to model the seasonality shape
+    'prior_scale': 10,
+}
+# Resolution of the saved forecast and component plots. 100 dpi renders and compresses
+# far fewer pixels than the former 150 dpi while staying sharp on screen.
+plot_dpi = 100
 
 # ---------------------------------------------------------------------
-# Function: sanitize_filename
+# Function: model_cache_key
 # ---------------------------------------------------------------------
-def sanitize_filename(file_name):
+def model_cache_key(forecast_data):
     """
-    Replace any characters that are forbidden in Windows filenames with underscores.
+    Build a key identifying a fitted model: an MD5 digest of the training data
+    (the 'ds' and 'y' columns) together with the model settings and the Prophet version.
     
     Parameters:
-      file_name (str): The original file name.
-      
+      forecast_data (DataFrame): Prophet training data with 'ds' and 'y' columns.
+    
     Returns:
-      str: A sanitized version of the file name safe for use on Windows.
+      str: Hexadecimal digest used as the cache file name.
     """
-    # The regular expression matches any forbidden character.
-    return re.sub(r'[\\/:*?"<>|]+', '_', str(file_name))
+    digest = hashlib.md5()
+    # Hash the dates and values row by row (independent of the index).
+    digest.update(pd.util.hash_pandas_object(forecast_data[['ds', 'y']], index=False).values.tobytes())
+    # Include the settings and the Prophet version so models fitted with other settings, or serialized
+    # by another Prophet version, are never reused.
+    digest.update(repr((sorted(prophet_settings.items()), sorted(monthly_seasonality.items()),
+                        prophet_version)).encode())
+    return digest.hexdigest()
 
 # ---------------------------------------------------------------------
 # Function: run_prophet_on_subdf
 # ---------------------------------------------------------------------
-def run_prophet_on_subdf(product_data, product_name, file_base_name, output_directory, forecast_periods=12):
+def run_prophet_on_subdf(product_data, product_name, file_base_name, output_directory, forecast_periods=12,
+                         model_cache_folder=None, duplicate_product_names=(), min_points=12):
     """
     Fit a Prophet forecasting model on a single product's data,
     generate future predictions, and save both forecast and component plots.
+    When a model cache folder is given, a model previously fitted on the same data
+    is loaded from disk instead of being refitted. When the data has changed, the new
+    fit is warm-started from the parameters of this product's previous fit.
     
     Parameters:
       product_data (DataFrame): Data for one product (must include 'Date' and 'Value' columns).
@@ -72,128 +83,240 @@ def run_prophet_on_subdf(product_data, product_name, file_base_name, output_dire
       file_base_name (str): The base name from the original input file.
       output_directory (str): Directory to save the generated plots.
       forecast_periods (int): The number of future periods to forecast (default 12).
+      model_cache_folder (str): Directory holding the fitted models as JSON (None disables the cache).
+      duplicate_product_names (sequence): Other products with exactly the same data; the forecast is
+                                          plotted for each of them too, without fitting again.
+      min_points (int): Minimum number of data points needed to fit a model (default 12, one year of months).
     """
-    # Remove rows with missing values in 'Value' and sort the data by 'Date'
-    product_data = product_data.dropna(subset=['Value']).sort_values('Date')
-    if product_data.empty:
-        return  # Exit if there's no data to forecast
-
-    # Prepare the DataFrame for Prophet by selecting relevant columns and renaming them
-    forecast_data = product_data[['Date', 'Value']].copy()
-    # Prophet requires columns to be named 'ds' (for date) and 'y' (for the value)
-    forecast_data.rename(columns={'Date': 'ds', 'Value': 'y'}, inplace=True)
-    forecast_data['ds'] = pd.to_datetime(forecast_data['ds'])  # Ensure 'ds' is in datetime format
-
-    # Initialize the Prophet model with custom settings:
-    # - yearly seasonality enabled to capture annual trends
-    # - weekly seasonality disabled
-    # - increased prior scales for seasonality and trend flexibility
-    model = Prophet(
-        weekly_seasonality=False,
-        yearly_seasonality=True,
-        seasonality_prior_scale=15,   # Default is 10; increased for flexibility
-        changepoint_prior_scale=0.5   # Default is 0.05; increased for more responsive trend changes
-    )
+    # Take the dates and values as NumPy arrays and remove the points with a missing value.
+    dates = product_data['Date'].to_numpy(dtype='datetime64[ns]')
+    values = product_data['Value'].to_numpy(dtype=np.float64)
+    has_value = ~np.isnan(values)
+    dates, values = dates[has_value], values[has_value]
+    if values.size < min_points:
+        # Exit if there's no data, or too little for a meaningful forecast.
+        print(f"   -> Skipping {product_name}: {values.size} data points (fewer than {min_points})")
+        return
 
-    # Add a custom monthly seasonality component to capture monthly fluctuations.
-    model.add_seasonality(
-        name='monthly',
-        period=30.5,        # Approximately the number of days in a month
-        fourier_order=5,    # Number of Fourier terms to model the seasonality shape
-        prior_scale=10
-    )
+    # Build the DataFrame for Prophet in one step, sorted by date.
+    # Prophet requires columns to be named 'ds' (for date) and 'y' (for the value).
+    date_order = np.argsort(dates, kind='stable')
+    forecast_data = pd.DataFrame({'ds': dates[date_order], 'y': values[date_order]})
+
+    # Look for a model already fitted on exactly this data.
+    model = None
+    if model_cache_folder:
+        cache_path = os.path.join(model_cache_folder, f"{model_cache_key(forecast_data)}.json")
+        if os.path.exists(cache_path):
+            # An unreadable, truncated or incompatible cache entry only means the model is fitted again
+            # (and the entry overwritten below).
+            try:
+                with open(cache_path, 'r') as cache_file:
+                    model = model_from_json(cache_file.read())
+            except Exception:
+                model = None
+
+    if model is None:
+        # Initialize the Prophet model with the shared settings and monthly seasonality.
+        model = Prophet(**prophet_settings)
+        model.add_seasonality(**monthly_seasonality)
 
-    # Fit the model on the historical data.
-    model.fit(forecast_data)
+        # Warm start: the parameters of this product's previous fit (typically the same series
+        # minus the newest points) are a good starting point, so L-BFGS needs fewer iterations.
+        # Prophet falls back to its default for any parameter whose shape no longer matches.
+        initial_parameters = None
+        if model_cache_folder:
+            warm_start_path = os.path.join(model_cache_folder,
+                                           f"{file_base_name}__{sanitize_filename(product_name)}__init.json")
+            if os.path.exists(warm_start_path):
+                # An unreadable or incomplete warm-start file only means the fit starts from Prophet's defaults.
+                try:
+                    with open(warm_start_path, 'r') as warm_start_file:
+                        initial_parameters = json.load(warm_start_file)
+                    initial_parameters['delta'] = np.array(initial_parameters['delta'])
+                    initial_parameters['beta'] = np.array(initial_parameters['beta'])
+                except (OSError, ValueError, KeyError, TypeError):
+                    initial_parameters = None
+
+        # Fit the model on the historical data.
+        if initial_parameters is None:
+            model.fit(forecast_data)
+        else:
+            model.fit(forecast_data, init=initial_parameters)
+
+        if model_cache_folder:
+            # Keep the fitted parameters (MAP estimates, one row each) as the next warm start. Like the model
+            # below, it is written to a temporary file first and then renamed, so it is never left half written.
+            temporary_path = f"{warm_start_path}.{os.getpid()}.tmp"
+            with open(temporary_path, 'w') as warm_start_file:
+                json.dump({
+                    'k': float(model.params['k'][0, 0]),
+                    'm': float(model.params['m'][0, 0]),
+                    'sigma_obs': float(model.params['sigma_obs'][0, 0]),
+                    'delta': model.params['delta'][0].tolist(),
+                    'beta': model.params['beta'][0].tolist(),
+                }, warm_start_file)
+            os.replace(temporary_path, warm_start_path)
+
+            # Write to a temporary file first and then rename it, so a concurrent
+            # reader never sees a partially written model.
+            temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(temporary_path, 'w') as cache_file:
+                cache_file.write(model_to_json(model))
+            os.replace(temporary_path, cache_path)
 
     # Create a DataFrame that extends into the future by 'forecast_periods' months.
     future_dates = model.make_future_dataframe(periods=forecast_periods, freq='MS')  # 'MS' = Month Start
     # Use the model to predict future values.
     forecast = model.predict(future_dates)
 
-    # Generate the forecast plot (shows historical data plus predictions)
-    forecast_plot = model.plot(forecast)
-    forecast_plot.suptitle(f"Prophet Forecast - Product: {product_name}", fontsize=14)
-    forecast_plot.subplots_adjust(top=0.88)  # Adjust layout to ensure the title is not clipped
-
-    # Create a safe file name for the product by removing forbidden characters.
-    safe_product_name = sanitize_filename(product_name)
-    forecast_filename = f"{file_base_name}__{safe_product_name}__forecast.png"
-    forecast_output_path = os.path.join(output_directory, forecast_filename)
-    # Save the forecast plot as a PNG file.
-    forecast_plot.savefig(forecast_output_path, dpi=150)
-    plt.close(forecast_plot)  # Close the figure to free memory
-    print(f"   -> Saved forecast: {forecast_output_path}")
-
-    # Generate the components plot (shows trend, yearly and monthly seasonality, etc.)
-    components_plot = model.plot_components(forecast)
-    components_plot.suptitle(f"Forecast Components - Product: {product_name}", fontsize=14)
-    components_plot.subplots_adjust(top=0.88)
-    components_filename = f"{file_base_name}__{safe_product_name}__components.png"
-    components_output_path = os.path.join(output_directory, components_filename)
-    # Save the components plot.
-    components_plot.savefig(components_output_path, dpi=150)
-    plt.close(components_plot)
-    print(f"   -> Saved components: {components_output_path}")
+    # Plot the forecast for this product and for every product with identical data.
+    for plotted_product_name in (product_name, *duplicate_product_names):
+        # Generate the forecast plot (shows historical data plus predictions)
+        forecast_plot = model.plot(forecast)
+        forecast_plot.suptitle(f"Prophet Forecast - Product: {plotted_product_name}", fontsize=14)
+        forecast_plot.subplots_adjust(top=0.88)  # Adjust layout to ensure the title is not clipped
+
+        # Create a safe file name for the product by removing forbidden characters.
+        safe_product_name = sanitize_filename(plotted_product_name)
+        forecast_filename = f"{file_base_name}__{safe_product_name}__forecast.png"
+        forecast_output_path = os.path.join(output_directory, forecast_filename)
+        # Save the forecast plot as a PNG file.
+        forecast_plot.savefig(forecast_output_path, dpi=plot_dpi)
+        plt.close(forecast_plot)  # Close the figure to free memory
+        print(f"   -> Saved forecast: {forecast_output_path}")
+
+        # Generate the components plot (shows trend, yearly and monthly seasonality, etc.)
+        components_plot = model.plot_components(forecast)
+        components_plot.suptitle(f"Forecast Components - Product: {plotted_product_name}", fontsize=14)
+        components_plot.subplots_adjust(top=0.88)
+        components_filename = f"{file_base_name}__{safe_product_name}__components.png"
+        components_output_path = os.path.join(output_directory, components_filename)
+        # Save the components plot.
+        components_plot.savefig(components_output_path, dpi=plot_dpi)
+        plt.close(components_plot)
+        print(f"   -> Saved components: {components_output_path}")
 
 # ---------------------------------------------------------------------
 # Function: generate_forecasts
 # ---------------------------------------------------------------------
-def generate_forecasts(normalized_folder='normalized_files', output_folder='regression_plots', forecast_periods=12):
+def generate_forecasts(normalized_folder='normalized_files', output_folder='regression_plots', forecast_periods=12,
+                       max_workers=None, model_cache_folder=os.path.join('.cache', 'prophet'), min_points=12):
     """
     Read each normalized CSV file (with columns [Date, Product, Value]) from the given folder,
     group the data by product, and run the Prophet forecast for each product.
+    The per-product forecasts are independent and run in parallel worker processes.
     Save the resulting forecast and component plots to the output folder.
     
     Parameters:
-      normalized_folder (str): Directory containing the normalized CSV files.
+      normalized_folder (str or dict): Directory containing the normalized CSV files, or a dict mapping base file
+        names to normalized DataFrames (as returned by normalization.process_folder).
       output_folder (str): Directory where the output plots will be saved.
       forecast_periods (int): Number of future periods (months) to forecast.
+      max_workers (int): Number of worker processes fitting models in parallel (default: one per CPU core).
+      model_cache_folder (str): Directory where fitted models are kept between runs (None disables the cache).
+      min_points (int): Products with fewer data points than this are skipped.
     """
     # Create the output folder if it doesn't exist.
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
+    # Create the model cache folder if it doesn't exist.
+    if model_cache_folder:
+        os.makedirs(model_cache_folder, exist_ok=True)
 
-    # Get a list of all files ending with '_normalized.csv' in the normalized folder.
-    normalized_files = glob.glob(os.path.join(normalized_folder, '*_normalized.csv'))
-    if not normalized_files:
+    # Normalized DataFrames that are already in memory are used as they are. Otherwise get all files
+    # ending with '_normalized.csv' in the normalized folder.
+    # A single os.scandir pass lists the folder; the entries are filtered by their name suffix.
+    # 'normalized_sources' maps each base file name (without extension) to its DataFrame or CSV file.
+    normalized_sources = {}
+    if isinstance(normalized_folder, dict):
+        normalized_sources = normalized_folder
+    elif os.path.isdir(normalized_folder):
+        with os.scandir(normalized_folder) as folder_entries:
+            normalized_sources = {os.path.splitext(entry.name)[0]: entry.path for entry in folder_entries
+                                  if entry.name.endswith('_normalized.csv') and entry.is_file()}
+    if not normalized_sources:
         print(f"No normalized files found in '{normalized_folder}'.")
         return
 
-    # Process each normalized CSV file.
-    for csv_file in normalized_files:
-        # Extract the base filename (without extension) for naming output files.
-        file_base_name = os.path.splitext(os.path.basename(csv_file))[0]
-        print(f"\n[Prophet] Processing file: {csv_file}")
-
-        # Read the CSV file, treating all columns as strings.
-        data_frame = pd.read_csv(csv_file, dtype=str)
-        # Standardize column names by stripping whitespace and capitalizing.
-        data_frame.columns = data_frame.columns.str.strip().str.capitalize()
-
-        # Ensure the file contains exactly three columns: Date, Product, and Value.
-        required_columns = {'Date', 'Product', 'Value'}
-        if set(data_frame.columns) != required_columns:
-            print("   -> Skipping (not 3-col [Date, Product, Value])")
-            continue
-
-        # Convert the Date column into proper datetime objects using our parser.
-        data_frame['Date'] = data_frame['Date'].apply(parse_portuguese_date)
-        # Standardize the numeric values: replace commas with periods and convert to numbers.
-        data_frame['Value'] = data_frame['Value'].str.replace(',', '.')
-        data_frame['Value'] = pd.to_numeric(data_frame['Value'], errors='coerce')
-        # Remove any rows with invalid or missing dates.
-        data_frame.dropna(subset=['Date'], inplace=True)
-
-        # Group the data by product and run the forecast for each group.
-        for product_name, product_data in data_frame.groupby('Product'):
-            run_prophet_on_subdf(
-                product_data,      # DataFrame for the product
-                product_name,    
-                file_base_name,  
-                output_folder,  
-                forecast_periods   # Number of future periods to forecast
-            )
+    # Fitting a Prophet model is CPU-bound and each product is independent,
+    # so the forecasts are spread over a pool of worker processes.
+    forecast_jobs = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Process each normalized DataFrame or CSV file (the base filename is used for naming output files).
+        for file_base_name, normalized_source in normalized_sources.items():
+            if isinstance(normalized_source, pd.DataFrame):
+                # An in-memory normalized DataFrame already has parsed dates, numeric values and a
+                # categorical Product column; only the rows without a date are dropped.
+                print(f"\n[Prophet] Processing data: {file_base_name}")
+                data_frame = normalized_source.dropna(subset=['Date'])
+            else:
+                print(f"\n[Prophet] Processing file: {normalized_source}")
+
+                # Read the CSV file with the multithreaded pyarrow parser (the C parser without pyarrow), which types
+                # numeric columns while reading.
+                # Product names repeat on every row, so they are read straight into a categorical column.
+                data_frame = read_csv_file(normalized_source, dtype={'Product': 'category'})
+                # Standardize column names by stripping whitespace and capitalizing (the original names are kept
+                # to re-read a column).
+                original_columns = dict(zip(data_frame.columns.str.strip().str.capitalize(), data_frame.columns))
+                data_frame.columns = list(original_columns)
+
+                # Ensure the file contains exactly three columns: Date, Product, and Value.
+                required_columns = {'Date', 'Product', 'Value'}
+                if set(data_frame.columns) != required_columns:
+                    print("   -> Skipping (not 3-col [Date, Product, Value])")
+                    continue
+
+                # Convert the Date column into proper datetime objects using our vectorized parser.
+                data_frame['Date'] = parse_portuguese_dates(data_frame['Date'])
+                # Standardize the numeric values. The normalized files use decimal points, so the reader parses
+                # them as numbers directly. Otherwise (decimal commas) only the Value column is read again with
+                # decimal=',', which the reader converts in C; mixed or malformed values are converted by
+                # replacing commas with periods.
+                if not pd.api.types.is_numeric_dtype(data_frame['Value']):
+                    value_column = original_columns['Value']
+                    comma_values = read_csv_file(normalized_source, decimal=',', usecols=[value_column])[value_column]
+                    if pd.api.types.is_numeric_dtype(comma_values):
+                        data_frame['Value'] = comma_values.to_numpy(dtype=np.float64)
+                    else:
+                        data_frame['Value'] = data_frame['Value'].astype(str).str.replace(',', '.', regex=False)
+                        data_frame['Value'] = pd.to_numeric(data_frame['Value'], errors='coerce')
+                # Remove any rows with invalid or missing dates.
+                data_frame.dropna(subset=['Date'], inplace=True)
+
+            # Group the data by product. Products whose series are identical (same dates and values, e.g.
+            # grades that track the same index) are fitted only once: they are keyed by a hash of their
+            # data, and the first product of each series plots the forecast for the others as well.
+            unique_series = {}
+            for product_name, product_data in data_frame.groupby('Product', observed=True):
+                series_data = product_data[['Date', 'Value']].dropna(subset=['Value']).sort_values('Date', kind='stable')
+                series_key = hashlib.md5(pd.util.hash_pandas_object(series_data, index=False).values.tobytes()).digest()
+                if series_key in unique_series:
+                    unique_series[series_key][2].append(product_name)
+                else:
+                    unique_series[series_key] = (product_name, series_data, [])
+
+            # Submit the forecast for each distinct series to the worker pool.
+            # The longest series (slowest fits) are submitted first so no long fit is left running
+            # alone at the end, and only the two columns the model needs are sent to the workers.
+            for product_name, series_data, duplicate_product_names in sorted(
+                    unique_series.values(), key=lambda series: len(series[1]), reverse=True):
+                forecast_jobs.append(executor.submit(
+                    run_prophet_on_subdf,
+                    series_data,       # DataFrame for the product
+                    product_name,
+                    file_base_name,
+                    output_folder,
+                    forecast_periods,  # Number of future periods to forecast
+                    model_cache_folder,
+                    duplicate_product_names,  # Products with the same data
+                    min_points
+                ))
+
+        # Wait for every forecast; result() re-raises any error that happened in a worker.
+        for job in forecast_jobs:
+            job.result()
 
 # ---------------------------------------------------------------------
 # Main Script Entry Point
@@ -9,7 +9,7 @@ from selenium.webdriver.support import expected_conditions as EC  # Conditions u
 import time  # Provides sleep and timing functions.
 import csv  # To write the scraped data to a CSV file.
 import os  # For operating system related tasks (e.g., creating directories).
-import re  # For regular expressions, used to sanitize filenames.
+from normalization import sanitize_filename  # File name rule shared by the whole pipeline.
 
 # ---------------------------------------------------------------------
 # Global Variables for the Wavelet Diagram (Not used in this script, but
@@ -23,29 +23,41 @@ wavelet_name = 'cmor1.5-1.0'   # Wavelet type (complex Morlet wavelet with param
 scales = np.arange(1, 128)     # Range of scales used in the Continuous Wavelet Transform (CWT).
 sampling_period = 1            # Sampling period (e.g., 1 for daily data).
 
-# ---------------------------------------------------------------------
-# Function: sanitize_filename
-# ---------------------------------------------------------------------
-def sanitize_filename(file_name):
-    """
-    Replace any forbidden filename characters (\, /, :, *, ?, ", <, >, |)
-    with underscores to ensure the filename is valid on Windows.
-    
-    Parameters:
-    file_name (str): The original filename.
-    
-    Returns:
-    str: A sanitized version of the filename.
-    """
-    return re.sub(r'[\\/:*?"<>|]+', '_', str(file_name))
-
 # ---------------------------------------------------------------------
 # Main Script Begins
 # ---------------------------------------------------------------------
 
-# Initialize the Chrome WebDriver and maximize the browser window.
-driver = webdriver.Chrome()
-driver.maximize_window()
+# Browser settings: headless Chrome without images, GPU or extensions, so the browser spends its time
+# on the chart (which is drawn on a canvas) instead of rendering the rest of the page.
+# Set headless_browser to False to watch the red hover dot while debugging.
+headless_browser = True
+# Chrome profile kept between runs, so the Data Studio scripts, styles and fonts come from the
+# browser's disk cache on later runs instead of being downloaded again. Set to None for a fresh profile.
+browser_profile_folder = os.path.join(os.path.expanduser('~'), '.pvc_scraper_profile')
+# Requests that are never needed for the chart data (images, web fonts, analytics and ads).
+BLOCKED_URL_PATTERNS = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.woff', '*.woff2',
+                        '*googletagmanager*', '*google-analytics*', '*doubleclick*']
+
+chrome_options = webdriver.ChromeOptions()
+if headless_browser:
+    chrome_options.add_argument('--headless=new')
+    chrome_options.add_argument('--window-size=1920,1080')  # Headless windows cannot be maximized.
+chrome_options.add_argument('--disable-gpu')
+chrome_options.add_argument('--disable-extensions')
+chrome_options.add_argument('--disable-dev-shm-usage')
+chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+if browser_profile_folder:
+    chrome_options.add_argument(f'--user-data-dir={browser_profile_folder}')
+    chrome_options.add_argument('--disk-cache-size=104857600')  # Up to 100 MB of cached page assets.
+chrome_options.page_load_strategy = 'eager'  # Continue once the DOM is ready; the iframe and chart are awaited explicitly.
+
+# Initialize the Chrome WebDriver and maximize the browser window (headless windows keep their fixed size).
+driver = webdriver.Chrome(options=chrome_options)
+if not headless_browser:
+    driver.maximize_window()
+# Block the unneeded requests through the DevTools protocol.
+driver.execute_cdp_cmd('Network.enable', {})
+driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
 
 def run():
     try:
@@ -114,99 +126,194 @@ def run():
         SCAN_END_X = chart_rectangle['width'] - 50
         SCAN_Y = chart_rectangle['height'] * 0.3  # 30% down from the top of the chart.
         current_scan_x = SCAN_START_X  # Initialize scanning position.
-        scraped_data = []             # List to hold data records.
+        # Adaptive stride: each date of the chart spans several pixels, so after a new date is captured
+        # the scan jumps ahead by half the pixel distance between the last two captured dates; every
+        # repeated date halves the stride again, so the scan closes in on the start of the next date.
+        # A jump that lands on a new date may have passed over a date narrower than the stride, so the
+        # skipped pixels are then re-scanned by bisection (see rescan_gap below); no date is left out.
+        MAX_SCAN_STRIDE = 16           # Upper bound for a single jump (in pixels).
+        scan_stride = 1                # Current step (in pixels); starts at the original 1-pixel pace.
+        last_capture_x = None          # x-coordinate where the previous new date was captured.
+        previous_x = None              # x-coordinate of the previous position that showed a tooltip...
+        previous_date = None           # ...and the date it showed.
+        scraped_data = []             # List to hold data records (in capture order).
+        capture_positions = []        # x-coordinate of every record, to write them in chart order.
+        seen_dates = set()            # Dates already captured, for constant-time duplicate checks.
         data_headers = set()          # Set to hold unique header names extracted from tooltips.
 
         # -----------------------------------------------------------------
-        # Define a JavaScript snippet that simulates a hover event.
+        # Define an asynchronous JavaScript snippet that simulates a hover event and reads the tooltip,
+        # so each scan position costs a single round trip to the browser.
         # The script:
         #   - Moves the red dot (visual indicator) to (x, y) coordinates.
         #   - Simulates mouseover, mousemove, and mouseenter events on the element under that point.
-        #   - Returns the outer HTML of the target element (if found).
+        #   - Reads the tooltip once a MutationObserver sees it change in response to these events, or
+        #     after a short settle delay (a tooltip with unchanged content causes no mutation). It is never
+        #     read in the same tick as the events, when it may still show the previous point.
+        #   - Returns the tooltip's date and its [label, value] metric pairs, {date: null} if no
+        #     tooltip appeared within the timeout, or null if there is no element at these coordinates.
         # -----------------------------------------------------------------
-        hover_event_script = """
+        hover_and_read_tooltip_script = """
+        const [x, y, settleMs, timeoutMs, done] = arguments;  // The last argument is the completion callback.
+
         // Update the position of the visual indicator (red dot).
         const dot = document.getElementById('hoverDot');
-        dot.style.left = `${arguments[0] - 4}px`;
-        dot.style.top = `${arguments[1] - 4}px`;
+        dot.style.left = `${x - 4}px`;
+        dot.style.top = `${y - 4}px`;
         dot.style.display = 'block';
 
         // Identify the element at the given (x, y) position.
-        const targetElement = document.elementFromPoint(arguments[0], arguments[1]);
-        if (targetElement) {
-            // Dispatch multiple events to simulate a hover that triggers tooltip display.
-            ['mouseover', 'mousemove', 'mouseenter'].forEach(eventType => {
-                targetElement.dispatchEvent(new MouseEvent(eventType, {
-                    bubbles: true,
-                    clientX: arguments[0],
-                    clientY: arguments[1],
-                    view: window
-                }));
-            });
+        const targetElement = document.elementFromPoint(x, y);
+        if (!targetElement) {
+            done(null);
+            return;
         }
-        // Return the HTML of the target element if it exists.
-        return targetElement ? targetElement.outerHTML : null;
+
+        // Read the tooltip if it is visible:
+        //   - The first list item contains the date.
+        //   - The remaining list items contain metrics (label and value spans).
+        // Returns null while no tooltip is visible.
+        const readTooltip = () => {
+            const tooltip = document.querySelector('div.google-visualization-tooltip.visible');
+            if (!tooltip) {
+                return null;
+            }
+            const dateSpan = tooltip.querySelector('li:first-child span');
+            const metrics = Array.from(tooltip.querySelectorAll('li:not(:first-child)'))
+                .map(item => Array.from(item.querySelectorAll('span.custom-label'), span => span.innerText.trim()))
+                .filter(labelSpans => labelSpans.length >= 2)
+                .map(labelSpans => [labelSpans[0], labelSpans[1]]);
+            return {date: dateSpan ? dateSpan.innerText.trim() : '', metrics: metrics};
+        };
+        // Complete the call once, stopping the observer and both timers.
+        let finished = false;
+        const finish = result => {
+            if (finished) {
+                return;
+            }
+            finished = true;
+            observer.disconnect();
+            clearTimeout(settle);
+            clearTimeout(timeout);
+            done(result);
+        };
+        const finishIfVisible = () => {
+            const result = readTooltip();
+            if (result) {
+                finish(result);
+            }
+        };
+        // Observe before dispatching the events, so the tooltip update they cause is not missed
+        // (the observer callback runs after the event handlers, never in the same tick).
+        const observer = new MutationObserver(finishIfVisible);
+        observer.observe(document.body, {subtree: true, childList: true, characterData: true,
+                                         attributes: true, attributeFilter: ['class']});
+        const settle = setTimeout(finishIfVisible, settleMs);
+        const timeout = setTimeout(() => finish({date: null, metrics: []}), timeoutMs);
+
+        // Dispatch multiple events to simulate a hover that triggers tooltip display.
+        ['mouseover', 'mousemove', 'mouseenter'].forEach(eventType => {
+            targetElement.dispatchEvent(new MouseEvent(eventType, {
+                bubbles: true,
+                clientX: x,
+                clientY: y,
+                view: window
+            }));
+        });
         """
+        # Delay (in milliseconds) after which the tooltip is read even if it did not change, e.g. when
+        # the hover stays on the same date and the chart leaves the tooltip as it was.
+        TOOLTIP_SETTLE_MILLISECONDS = 50
+        # Allow the asynchronous script enough time for the longest tooltip wait.
+        driver.set_script_timeout(5)
 
         # -----------------------------------------------------------------
-        # Loop across the horizontal range (SCAN_START_X to SCAN_END_X) to simulate hover events
-        # and extract tooltip data from the chart.
-        # In this updated version, we move very slowly by incrementing the x-coordinate by 1 pixel at every step.
+        # Function: hover_date
+        # Hovers at the x-coordinate, records the tooltip's data if its date has not been captured yet,
+        # and returns the date together with whether it is new (None, False if no tooltip could be read).
         # -----------------------------------------------------------------
-        while current_scan_x <= SCAN_END_X:
+        def hover_date(scan_x):
             try:
-                # Set target coordinates for hovering.
-                target_x = current_scan_x
-                target_y = SCAN_Y
-
-                # Execute the hover event script with the target coordinates.
-                element_html = driver.execute_script(hover_event_script, target_x, target_y)
-                
-                # If no element is found at these coordinates, raise an exception.
-                if not element_html:
+                # Wait briefly for the tooltip to become visible: up to 1.5 seconds for the first one,
+                # then 0.5 seconds, as the tooltip appears quickly once the chart has responded.
+                tooltip_wait_milliseconds = 500 if scraped_data else 1500
+                # Hover at the target coordinates and read the tooltip in a single browser call.
+                tooltip_data = driver.execute_async_script(hover_and_read_tooltip_script, scan_x, SCAN_Y,
+                                                           TOOLTIP_SETTLE_MILLISECONDS, tooltip_wait_milliseconds)
+
+                # If no element is found at these coordinates, or no tooltip appeared, raise an exception.
+                if tooltip_data is None:
                     raise Exception("No element found at the current coordinates")
+                if tooltip_data["date"] is None:
+                    raise Exception("No tooltip visible at the current coordinates")
+            except Exception as error:
+                # Print an error message (up to 50 characters).
+                print(f"⚠️ Error at X={scan_x}: {str(error)[:50]}")
+                return None, False
 
-                # Wait briefly (up to 1.5 seconds) for the tooltip to become visible.
-                tooltip_element = WebDriverWait(driver, 1.5).until(
-                    EC.visibility_of_element_located(
-                        (By.CSS_SELECTOR, "div.google-visualization-tooltip.visible"))
-                )
-
-                # -----------------------------------------------------------------
-                # Extract data from the tooltip:
-                #   - The first list item contains the date.
-                #   - The remaining list items contain metrics (key-value pairs).
-                # -----------------------------------------------------------------
-                tooltip_date = tooltip_element.find_element(By.CSS_SELECTOR, "li:first-child span").text.strip()
-                data_entry = {"Date": tooltip_date}
-                
-                # Loop through the other list items to extract metric data.
-                for metric_element in tooltip_element.find_elements(By.CSS_SELECTOR, "li:not(:first-child)"):
-                    # Each metric is expected to have two span elements: one for the label and one for the value.
-                    label_spans = metric_element.find_elements(By.CSS_SELECTOR, "span.custom-label")
-                    if len(label_spans) >= 2:
-                        metric_label = label_spans[0].text.strip().rstrip(':')
-                        metric_value = label_spans[1].text.strip()
-                        data_entry[metric_label] = metric_value
-                        data_headers.add(metric_label)
-                
-                # Avoid duplicate entries: add the entry only if the date hasn't been captured yet.
-                if not any(existing_entry["Date"] == tooltip_date for existing_entry in scraped_data):
-                    scraped_data.append(data_entry)
-                    print(f"✅ Captured data for date: {tooltip_date}")
-                # In all cases, advance by 1 pixel (moving very slowly).
-                current_scan_x += 1
+            # -----------------------------------------------------------------
+            # Build the data record from the tooltip:
+            #   - The date from the first list item.
+            #   - One (label, value) metric per remaining list item.
+            # -----------------------------------------------------------------
+            tooltip_date = tooltip_data["date"]
+            data_entry = {"Date": tooltip_date}
+            for label_text, metric_value in tooltip_data["metrics"]:
+                metric_label = label_text.rstrip(':')
+                data_entry[metric_label] = metric_value
+                data_headers.add(metric_label)
 
-            except Exception as error:
-                # Print an error message (up to 50 characters) and move forward by 1 pixel.
-                print(f"⚠️ Error at X={current_scan_x}: {str(error)[:50]}")
+            # Avoid duplicate entries: add the entry only if the date hasn't been captured yet.
+            if tooltip_date in seen_dates:
+                return tooltip_date, False
+            seen_dates.add(tooltip_date)
+            scraped_data.append(data_entry)
+            capture_positions.append(scan_x)
+            print(f"✅ Captured data for date: {tooltip_date}")
+            return tooltip_date, True
+
+        # -----------------------------------------------------------------
+        # Function: rescan_gap
+        # Captures every date between two scanned x-coordinates. Each date covers one contiguous run of
+        # pixels, so nothing lies between two positions showing the same date; otherwise the middle pixel
+        # is hovered and both halves are searched. This costs a few hovers per jump, not one per pixel.
+        # -----------------------------------------------------------------
+        def rescan_gap(left_x, left_date, right_x, right_date):
+            if right_x - left_x <= 1 or (left_date is not None and left_date == right_date):
+                return
+            middle_x = (left_x + right_x) // 2
+            middle_date, _ = hover_date(middle_x)
+            rescan_gap(left_x, left_date, middle_x, middle_date)
+            rescan_gap(middle_x, middle_date, right_x, right_date)
+
+        # -----------------------------------------------------------------
+        # Loop across the horizontal range (SCAN_START_X to SCAN_END_X) to simulate hover events
+        # and extract tooltip data from the chart.
+        # The x-coordinate advances by the adaptive stride (see above) instead of 1 pixel at every step.
+        # -----------------------------------------------------------------
+        while current_scan_x <= SCAN_END_X:
+            tooltip_date, is_new_date = hover_date(current_scan_x)
+            if tooltip_date is None:
+                # No tooltip here: move forward by 1 pixel.
                 current_scan_x += 1
-                continue
+            else:
+                # Capture any date the jump from the previous tooltip position passed over.
+                if previous_x is not None and tooltip_date != previous_date:
+                    rescan_gap(previous_x, previous_date, current_scan_x, tooltip_date)
+                if is_new_date:
+                    # A new date: jump ahead by half the width of the previous date.
+                    if last_capture_x is not None:
+                        scan_stride = min(MAX_SCAN_STRIDE, max(1, (current_scan_x - last_capture_x) // 2))
+                    last_capture_x = current_scan_x
+                else:
+                    # Still on an already captured date: halve the stride (down to 1 pixel).
+                    scan_stride = max(1, scan_stride // 2)
+                previous_x, previous_date = current_scan_x, tooltip_date
+                current_scan_x += scan_stride
 
-            finally:
-                # Calculate and print the scanning progress as a percentage.
-                progress = ((current_scan_x - SCAN_START_X) / (SCAN_END_X - SCAN_START_X)) * 100
-                print(f"Progress: {min(progress, 100):.1f}%")
+            # Calculate and print the scanning progress as a percentage.
+            progress = ((current_scan_x - SCAN_START_X) / (SCAN_END_X - SCAN_START_X)) * 100
+            print(f"Progress: {min(progress, 100):.1f}%")
 
     finally:
         # -----------------------------------------------------------------
@@ -221,10 +328,16 @@ def run():
         if scraped_data:
             output_csv_path = os.path.join(output_data_folder, "pvc_data.csv")
             # Write the data to CSV with the field names: "Date" plus all other sorted headers.
+            # The records are turned into rows (lists in header order, '' for a missing metric) once,
+            # so the whole table is written with a single writerows call.
+            csv_headers = ["Date"] + sorted(data_headers)
+            # The records are written in chart order (re-scanned gaps capture some dates after later ones).
+            csv_rows = [[data_entry.get(header, "") for header in csv_headers]
+                        for _, data_entry in sorted(zip(capture_positions, scraped_data), key=lambda capture: capture[0])]
             with open(output_csv_path, "w", newline="", encoding="utf-8") as csv_file:
-                csv_writer = csv.DictWriter(csv_file, fieldnames=["Date"] + sorted(data_headers))
-                csv_writer.writeheader()
-                csv_writer.writerows(scraped_data)
+                csv_writer = csv.writer(csv_file)
+                csv_writer.writerow(csv_headers)
+                csv_writer.writerows(csv_rows)
             print(f"✅ Saved {len(scraped_data)} records to {output_csv_path}")
         else:
             print("❌ No data collected")
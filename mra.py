@@ -5,72 +5,80 @@
 
 import os                    # Provides functions for interacting with the operating system.
 import glob                  # Helps in file pattern matching (e.g., finding all CSV files in a folder).
-import re                    # Provides regular expressions for text processing (e.g., sanitizing filenames).
 import pandas as pd          # Data analysis library for handling DataFrames.
 import numpy as np           # Supports numerical operations and array manipulation.
+import matplotlib            # Plotting library; the non-interactive 'Agg' backend is selected below.
+matplotlib.use('Agg')        # Render straight to image files (no GUI), which is also safe in worker processes.
 import matplotlib.pyplot as plt  # Used for creating plots and visualizations.
+from concurrent.futures import ProcessPoolExecutor  # Runs the per-product analyses in parallel worker processes.
 import pywt                  # PyWavelets library: used to perform wavelet transforms.
-from dateutil.parser import parse  # Used to parse date strings into datetime objects.
+from normalization import parse_portuguese_dates, sanitize_filename  # Date parser and file name rule shared by the pipeline
 
 # ---------------------------------------------------------------------
-# Function: parse_portuguese_date
+# Global Variables for the MRA
 # ---------------------------------------------------------------------
-def parse_portuguese_date(date_str):
-    """
-    Safely parse potential Portuguese month abbreviations into English,
-    then parse with dateutil. If invalid, return pd.NaT ("Not a Time").
-    
-    Parameters:
-      date_str (str): A date string that may include Portuguese month abbreviations.
-    
-    Returns:
-      datetime or pd.NaT: The parsed datetime object, or pd.NaT if parsing fails.
-    """
-    # Dictionary mapping Portuguese month abbreviations to English abbreviations.
-    month_map = {
-        'jan.': 'Jan', 'fev.': 'Feb', 'mar.': 'Mar', 'abr.': 'Apr',
-        'mai.': 'May', 'jun.': 'Jun', 'jul.': 'Jul', 'ago.': 'Aug',
-        'set.': 'Sep', 'out.': 'Oct', 'nov.': 'Nov', 'dez.': 'Dec'
-    }
-    # If the input is not a string, return pd.NaT.
-    if not isinstance(date_str, str):
-        return pd.NaT
-
-    # Replace each Portuguese abbreviation with the corresponding English abbreviation.
-    for pt, en in month_map.items():
-        date_str = date_str.replace(pt, en)
-    try:
-        # Parse the date string.
-        # 'dayfirst=True' because the date is in day-first format.
-        # 'fuzzy=True' allows ignoring extra text.
-        return parse(date_str, dayfirst=True, fuzzy=True)
-    except:
-        return pd.NaT
+# 'db4' is a Daubechies wavelet with 4 vanishing moments. The Wavelet object (with its filter length)
+# is built once here and reused by every analysis.
+wavelet_name = 'db4'
+wavelet = pywt.Wavelet(wavelet_name)
+mra_dpi = 90                # Resolution of the saved diagrams (PNG size and encoding time grow with dpi squared).
+mra_antialiased = False     # Antialiased lines look smoother but take about a third longer to rasterize.
 
 # ---------------------------------------------------------------------
-# Function: sanitize_filename
+# Function: get_mra_figure
 # ---------------------------------------------------------------------
-def sanitize_filename(name):
+# The MRA figures reused by this process, keyed by their number of subplots (the number of
+# decomposition levels + 2). They are created on first use (so each worker process builds its own)
+# and never closed; for every product only the data of their lines is replaced.
+mra_figures = {}
+
+def get_mra_figure(num_plots):
     """
-    Replace forbidden filename characters with underscores,
-    so that Windows does not complain about invalid paths.
+    Return the figure and lines for an MRA diagram with the given number of subplots,
+    creating them (with their labels and grids) the first time that size is needed.
     
     Parameters:
-      name (str): The original filename.
-      
+      num_plots (int): Number of stacked subplots (detail components + approximation + data).
+    
     Returns:
-      str: A sanitized filename safe for saving.
+      dict: The 'figure', its 'axes' and one (initially empty) line per subplot in 'lines':
+            the detail components first, then the approximation, then the normalized data.
     """
-    return re.sub(r'[\\/:*?"<>|]+', '_', name)
+    if num_plots not in mra_figures:
+        fig, axes = plt.subplots(num_plots, 1, sharex=True, figsize=(10, 2 * num_plots))
+        # Fixed margins, set once, instead of a tight_layout pass for every product:
+        # room for the rotated D/S labels on the left, the two-line title at the top
+        # and the date labels at the bottom (converted from inches to figure fractions).
+        fig_height = 2 * num_plots
+        fig.subplots_adjust(left=0.14, right=0.97, top=1 - 0.8 / fig_height, bottom=0.5 / fig_height, hspace=0.1)
+        dwt_level = num_plots - 2
+
+        lines = []
+        # One line per detail component, labeled "D1", "D2", etc. ("D" stands for detail).
+        for idx in range(dwt_level):
+            lines.append(axes[idx].plot([], [], 'C0', linewidth=1, antialiased=mra_antialiased)[0])
+            axes[idx].set_ylabel(f"D{idx+1}", rotation=0, labelpad=25)
+        # The approximation (smooth) component in the second-to-last subplot,
+        # labeled "S<level>" where S stands for the smooth or approximation component.
+        lines.append(axes[-2].plot([], [], 'C1', linewidth=1, antialiased=mra_antialiased)[0])
+        axes[-2].set_ylabel(f"S{dwt_level}", rotation=0, labelpad=25)
+        # The original (normalized) data in the last subplot.
+        lines.append(axes[-1].plot([], [], 'k', linewidth=1, antialiased=mra_antialiased)[0])
+        axes[-1].set_ylabel("Data", rotation=0, labelpad=25)
+        axes[-1].set_xlabel("Date")
+        for ax in axes:
+            ax.xaxis_date()  # The (shared) x-axis shows dates.
+            ax.grid(True)
+        mra_figures[num_plots] = {'figure': fig, 'axes': axes, 'lines': lines}
+    return mra_figures[num_plots]
 
 # ---------------------------------------------------------------------
-# Function: do_mra_on_subdf
+# Function: do_mra_on_series
 # ---------------------------------------------------------------------
-def do_mra_on_subdf(sub_df, base_name, product, output_folder):
+def do_mra_on_series(dates, values, base_name, product, output_folder):
     """
-    Perform the DWT-based Multi-Resolution Analysis (MRA) on the 'Value' time series
-    for a single product. This function:
-      - Sorts the data by Date and drops missing values.
+    Perform the DWT-based Multi-Resolution Analysis (MRA) on the value time series
+    of a single product. This function:
       - Normalizes the data to the range [0, 1].
       - Decomposes the normalized time series into detail and approximation components using DWT.
       - Reconstructs each detail component and the approximation.
@@ -78,65 +86,76 @@ def do_mra_on_subdf(sub_df, base_name, product, output_folder):
       - Saves the resulting diagram to the output folder.
     
     Parameters:
-      sub_df (DataFrame): Subset of data for one product (must include 'Date' and 'Value').
+      dates (ndarray): The product's dates, sorted in ascending order.
+      values (ndarray): The product's values (float32), aligned with 'dates', without missing values.
       base_name (str): Base name of the original file (used for output naming).
       product (str): The product name.
       output_folder (str): The directory where the output image will be saved.
     """
-    # Sort by Date and drop rows where 'Value' is missing.
-    sub_df = sub_df.dropna(subset=['Value']).sort_values('Date')
-    # Extract the time series values and corresponding dates.
-    time_series = sub_df['Value'].values
-    time_index = sub_df['Date']
+    # The time series values (float32: single precision is plenty for a plotted decomposition and halves
+    # the memory traffic; PyWavelets keeps the dtype for the coefficients and reconstructions)
+    # and the corresponding dates.
+    time_series = values
+    time_index = dates
 
     # If there's no data left after dropping missing values, exit the function.
     if len(time_series) == 0:
         return
+    # With fewer than two filter lengths of points the DWT has at most one (boundary dominated) level,
+    # so the diagram would carry no information; skip the transform and the plotting altogether.
+    if len(time_series) < 2 * wavelet.dec_len:
+        print(f"   -> MRA skipped for {product}: only {len(time_series)} points")
+        return
 
     # Normalize the time series to the range [0, 1] for consistent scaling.
-    min_val, max_val = time_series.min(), time_series.max()
-    if max_val != min_val:
-        norm_series = (time_series - min_val) / (max_val - min_val)
-    else:
-        norm_series = time_series - min_val  # All values are equal; normalization yields zeros.
+    # The minimum is subtracted into a new array once, which is then scaled in place by the
+    # reciprocal of the range (np.ptp), so no second temporary array or per-element division is needed.
+    value_range = np.ptp(time_series)
+    norm_series = time_series - time_series.min()
+    if value_range != 0:
+        norm_series *= np.float32(1.0) / value_range
+    # Otherwise all values are equal and the normalization yields zeros.
 
     # -----------------------------------------------------------------
     # Perform Discrete Wavelet Transform (DWT) using the 'db4' wavelet.
     # 'db4' is a Daubechies wavelet with 4 vanishing moments.
     # Determine the maximum level of decomposition possible, then use up to 8 levels.
     # -----------------------------------------------------------------
-    wavelet_name = 'db4'
-    max_decomp_level = pywt.dwt_max_level(len(norm_series), pywt.Wavelet(wavelet_name).dec_len)
+    max_decomp_level = pywt.dwt_max_level(len(norm_series), wavelet.dec_len)
     dwt_level = min(8, max_decomp_level)
     # Compute the wavelet decomposition coefficients.
-    wavelet_coeffs = pywt.wavedec(norm_series, wavelet_name, level=dwt_level)
+    wavelet_coeffs = pywt.wavedec(norm_series, wavelet, level=dwt_level)
 
     # -----------------------------------------------------------------
     # Reconstruct detail components for each level.
     # Each detail component represents the high-frequency parts (variations) at that level.
+    # pywt.upcoef rebuilds a single band directly from its own coefficients, instead of running
+    # a full inverse DWT over a coefficient list in which every other band is zero.
+    # upcoef keeps the full convolution at every level, so the samples that match the inverse
+    # DWT start after (filter length - 2) * (2**level - 1) extra samples.
     # -----------------------------------------------------------------
+    filter_length = wavelet.dec_len
     detail_components = []
     for i in range(1, len(wavelet_coeffs)):
-        coeffs_copy = []
-        # Create a copy of the coefficients where only the current level is kept,
-        # and all other levels are replaced with zeros.
-        for j, c in enumerate(wavelet_coeffs):
-            if j == i:
-                coeffs_copy.append(c)
-            else:
-                coeffs_copy.append(np.zeros_like(c))
-        # Reconstruct the signal corresponding to this detail component using the inverse DWT.
-        detail_signal = pywt.waverec(coeffs_copy, wavelet_name)[:len(norm_series)]
+        # Number of reconstruction steps from this detail band back to the signal.
+        level = len(wavelet_coeffs) - i
+        start = (filter_length - 2) * (2 ** level - 1)
+        # Reconstruct the signal corresponding to this detail component.
+        detail_signal = pywt.upcoef('d', wavelet_coeffs[i], wavelet, level=level)[start:start + len(norm_series)]
         detail_components.append(detail_signal)
     # Reverse the list so that the highest resolution detail (smallest scale) comes first.
     detail_components.reverse()
 
     # -----------------------------------------------------------------
-    # Reconstruct the approximation (the low-frequency component).
-    # Only the approximation coefficients (level 0) are kept; the rest are set to zeros.
+    # Reconstruct the approximation (the low-frequency component) from the approximation
+    # coefficients alone. Without any decomposition level it is the series itself.
     # -----------------------------------------------------------------
-    approx_coeffs = [wavelet_coeffs[0]] + [np.zeros_like(c) for c in wavelet_coeffs[1:]]
-    approximation_signal = pywt.waverec(approx_coeffs, wavelet_name)[:len(norm_series)]
+    if dwt_level > 0:
+        start = (filter_length - 2) * (2 ** dwt_level - 1)
+        approximation_signal = pywt.upcoef('a', wavelet_coeffs[0], wavelet,
+                                           level=dwt_level)[start:start + len(norm_series)]
+    else:
+        approximation_signal = wavelet_coeffs[0]
 
     # -----------------------------------------------------------------
     # Plot the Multi-Resolution Analysis (MRA):
@@ -144,111 +163,131 @@ def do_mra_on_subdf(sub_df, base_name, product, output_folder):
     # - The approximation signal is plotted.
     # - The original (normalized) data is also plotted.
     # The number of plots = number of detail components + 2.
+    # The figure of that size, with its lines and labels, is reused from earlier products;
+    # only the data of the lines is replaced and the axes limits are recomputed.
     # -----------------------------------------------------------------
     num_plots = dwt_level + 2
-    fig, axes = plt.subplots(num_plots, 1, sharex=True, figsize=(10, 2 * num_plots))
+    mra_figure = get_mra_figure(num_plots)
+    fig = mra_figure['figure']
     fig.suptitle(f"MRA (db4)\nFile: {base_name}, Product: {product}", fontsize=14)
 
-    # Plot each detail component.
-    for idx, detail in enumerate(detail_components):
-        axes[idx].plot(time_index, detail, 'C0', linewidth=1)
-        # Label the subplot with "D1", "D2", etc. ("D" stands for detail).
-        axes[idx].set_ylabel(f"D{idx+1}", rotation=0, labelpad=25)
-        axes[idx].grid(True)
-
-    # Plot the approximation (smooth) component in the second-to-last subplot.
-    axes[-2].plot(time_index, approximation_signal, 'C1', linewidth=1)
-    # Label with "S<level>" where S stands for the smooth or approximation component.
-    axes[-2].set_ylabel(f"S{dwt_level}", rotation=0, labelpad=25)
-    axes[-2].grid(True)
-
-    # Plot the original (normalized) data in the last subplot.
-    axes[-1].plot(time_index, norm_series, 'k', linewidth=1)
-    axes[-1].set_ylabel("Data", rotation=0, labelpad=25)
-    axes[-1].grid(True)
-    axes[-1].set_xlabel("Date")
-
-    # Adjust the layout so that subplots do not overlap.
-    plt.tight_layout()
+    for ax, line, signal in zip(mra_figure['axes'], mra_figure['lines'],
+                                [*detail_components, approximation_signal, norm_series]):
+        line.set_data(time_index, signal)
+        ax.relim()
+        ax.autoscale_view()
 
     # -----------------------------------------------------------------
     # Save the MRA diagram:
     # Create a safe file name for the product, construct the output path,
-    # save the figure as a PNG image at 150 dpi, and close the figure.
+    # and save the figure as a PNG image at mra_dpi. The figure stays open for the next product.
     # -----------------------------------------------------------------
     safe_product = sanitize_filename(product)
     out_name = f"{base_name}__MRA__{safe_product}.png"
     out_path = os.path.join(output_folder, out_name)
-    fig.savefig(out_path, dpi=150)
-    plt.close(fig)
+    fig.savefig(out_path, dpi=mra_dpi)
     print(f"   -> MRA saved: {out_path}")
 
 # ---------------------------------------------------------------------
 # Function: generate_mra_all_files
 # ---------------------------------------------------------------------
-def generate_mra_all_files(data_folder='normalized_files', output_folder='mra_diagrams'):
+def generate_mra_all_files(data_folder='normalized_files', output_folder='mra_diagrams', max_workers=None):
     """
     Process all normalized files in the specified data folder to generate MRA diagrams.
     For each file with exactly 3 columns (Date, Product, Value), perform MRA analysis.
+    The per-product analyses are independent and run in parallel worker processes.
     
     Parameters:
-      data_folder (str): Directory containing normalized data files.
+      data_folder (str or dict): Directory containing normalized data files, or a dict mapping base file
+        names to normalized DataFrames (as returned by normalization.process_folder).
       output_folder (str): Directory where the MRA diagrams will be saved.
+      max_workers (int): Number of worker processes (default: one per CPU core).
     """
     # Create the output folder if it doesn't exist.
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Find all files in the data folder (regardless of extension).
-    all_files = glob.glob(os.path.join(data_folder, '*.*'))
-    # Process each file.
-    for fpath in all_files:
-        # Get the file extension (e.g., .csv, .xls, .xlsx).
-        ext = os.path.splitext(fpath)[1].lower()
-        # Only process files with these extensions.
-        if ext not in ['.csv','.xls','.xlsx']:
-            continue
-
-        # Get the base file name (without directory and extension) for output naming.
-        base_name = os.path.splitext(os.path.basename(fpath))[0]
-
-        # Read the file as a DataFrame, interpreting all columns as strings.
-        if ext in ['.xls','.xlsx']:
-            df = pd.read_excel(fpath, dtype=str)
-        else:
-            df = pd.read_csv(fpath, dtype=str, encoding='utf-8')
-        
-        # Convert all column names to lower case and remove extra whitespace.
-        df.columns = df.columns.str.strip().str.lower()
-        
-        # Create a set of the column names.
-        colset = set(df.columns)
-        # Define the required set of columns.
-        needed = {'date','product','value'}
-        
-        # If the DataFrame has exactly 3 columns and they match the needed set:
-        if len(df.columns) == 3 and colset == needed:
-            print(f"\n[MRA] 3-col file: {fpath}")
+    # Normalized DataFrames that are already in memory are used as they are. Otherwise find all files
+    # in the data folder (regardless of extension).
+    # 'data_sources' maps each base file name (without directory and extension) to its DataFrame or file path.
+    if isinstance(data_folder, dict):
+        data_sources = data_folder
+    else:
+        data_sources = {os.path.splitext(os.path.basename(fpath))[0]: fpath
+                        for fpath in glob.glob(os.path.join(data_folder, '*.*'))}
+    # The DWT, plotting and PNG encoding of each product are CPU-bound and independent,
+    # so the analyses are spread over a pool of worker processes.
+    mra_jobs = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Process each DataFrame or file.
+        for base_name, fpath in data_sources.items():
+            if isinstance(fpath, pd.DataFrame):
+                # An in-memory normalized DataFrame already has parsed dates and numeric values;
+                # only the rows without a date are dropped.
+                print(f"\n[MRA] 3-col data: {base_name}")
+                df = fpath.dropna(subset=['Date'])
+            else:
+                # Get the file extension (e.g., .csv, .xls, .xlsx).
+                ext = os.path.splitext(fpath)[1].lower()
+                # Only process files with these extensions.
+                if ext not in ['.csv','.xls','.xlsx']:
+                    continue
+
+                # Read only the header row first, so files without the expected columns are skipped
+                # without loading their data.
+                if ext in ['.xls','.xlsx']:
+                    header = pd.read_excel(fpath, nrows=0).columns
+                else:
+                    header = pd.read_csv(fpath, nrows=0, encoding='utf-8').columns
+            
+                # Convert all column names to lower case and remove extra whitespace.
+                columns = header.str.strip().str.lower()
             
-            # Rename the columns to standard names with capital letters.
-            df.rename(columns={'date':'Date','product':'Product','value':'Value'}, inplace=True)
+                # Create a set of the column names.
+                colset = set(columns)
+                # Define the required set of columns.
+                needed = {'date','product','value'}
             
-            # Parse the Date column using the custom Portuguese date parser.
-            df['Date'] = df['Date'].apply(parse_portuguese_date)
-            # Replace commas with periods in the Value column to standardize decimals.
-            df['Value'] = df['Value'].str.replace(',', '.')
-            # Convert the Value column to numeric values.
-            df['Value'] = pd.to_numeric(df['Value'], errors='coerce')
-            # Drop rows where Date parsing failed.
-            df.dropna(subset=['Date'], inplace=True)
-            # Sort the DataFrame by Date.
-            df.sort_values('Date', inplace=True)
-
-            # Group the data by Product and perform MRA on each group.
-            for product, sub_df in df.groupby('Product'):
-                do_mra_on_subdf(sub_df, base_name, product, output_folder)
-
-        else:
-            # If the file does not have exactly 3 columns, skip it and print the column names.
-            print(f"\n[MRA] Skipping: {fpath}")
-            print("Columns are:", df.columns.tolist())
+                # If the file does not have exactly 3 columns matching the needed set, skip it and print the column names.
+                if len(columns) != 3 or colset != needed:
+                    print(f"\n[MRA] Skipping: {fpath}")
+                    print("Columns are:", columns.tolist())
+                    continue
+
+                print(f"\n[MRA] 3-col file: {fpath}")
+            
+                # Read just those columns, interpreting all of them as strings, and rename them
+                # to the standard names with capital letters.
+                standard_names = {'date':'Date','product':'Product','value':'Value'}
+                if ext in ['.xls','.xlsx']:
+                    df = pd.read_excel(fpath, dtype=str, usecols=list(header))
+                else:
+                    df = pd.read_csv(fpath, dtype=str, encoding='utf-8', usecols=list(header), engine='c')
+                df.columns = [standard_names[name] for name in columns]
+            
+                # Parse the Date column using the vectorized Portuguese date parser.
+                df['Date'] = parse_portuguese_dates(df['Date'])
+                # Replace decimal commas with periods (a plain, non-regex replacement) and convert
+                # the Value column to numbers in one step.
+                df['Value'] = pd.to_numeric(df['Value'].str.replace(',', '.', regex=False), errors='coerce')
+                # Drop rows where Date parsing failed.
+                df.dropna(subset=['Date'], inplace=True)
+
+            # Extract the dates and values as plain NumPy arrays, once per file, and mark the rows that have a value.
+            all_dates = df['Date'].to_numpy()
+            all_values = df['Value'].to_numpy(dtype=np.float32)
+            all_has_value = ~np.isnan(all_values)
+
+            # Group the rows by Product. 'indices' maps each product to its row positions,
+            # so no per-product DataFrame has to be built (observed=True: only the products that have rows).
+            for product, row_positions in df.groupby('Product', observed=True).indices.items():
+                # Keep this product's rows that have a value, put them in date order and submit its MRA
+                # to the worker pool. Only the two 1-D arrays are sent to the worker.
+                row_positions = row_positions[all_has_value[row_positions]]
+                row_positions = row_positions[np.argsort(all_dates[row_positions], kind='stable')]
+                mra_jobs.append(executor.submit(do_mra_on_series, all_dates[row_positions],
+                                                all_values[row_positions], base_name, product, output_folder))
+
+        # Wait for every analysis; result() re-raises any error that happened in a worker.
+        for job in mra_jobs:
+            job.result()
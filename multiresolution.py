@@ -1,55 +1,73 @@
+import re
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import pywt
-from dateutil.parser import parse
 
-def parse_portuguese_date(date_str):
-    month_map = {
-        'jan.': 'Jan', 'fev.': 'Feb', 'mar.': 'Mar', 'abr.': 'Apr',
-        'mai.': 'May', 'jun.': 'Jun', 'jul.': 'Jul', 'ago.': 'Aug',
-        'set.': 'Sep', 'out.': 'Oct', 'nov.': 'Nov', 'dez.': 'Dec', 'z.': 'Dec'
-    }
-    for pt_month, en_month in month_map.items():
-        date_str = date_str.replace(pt_month, en_month)
-    parts = date_str.split()
-    return parse(parts[0] + ' ' + parts[-1]) if len(parts) >= 2 else parse(date_str)
+month_pattern = re.compile(r'(jan|fev|mar|abr|mai|jun|jul|ago|set|out|nov|dez|z)\.')
+month_names = {
+    'jan': 'Jan', 'fev': 'Feb', 'mar': 'Mar', 'abr': 'Apr', 'mai': 'May', 'jun': 'Jun',
+    'jul': 'Jul', 'ago': 'Aug', 'set': 'Sep', 'out': 'Oct', 'nov': 'Nov', 'dez': 'Dec', 'z': 'Dec'
+}
+
+def parse_portuguese_dates(date_series):
+    # Vectorized parse_portuguese_date: translate the months with one regex pass, keep the first and last
+    # word of each date, and convert the whole column in a single pd.to_datetime call.
+    date_series = date_series.str.replace(month_pattern, lambda m: month_names[m.group(1)], regex=True)
+    parts = date_series.str.split()
+    first_and_last = (parts.str[0] + ' ' + parts.str[-1]).where(parts.str.len() >= 2, date_series)
+    return pd.to_datetime(first_and_last, format='mixed')
 
 # 1) Load CSV, parse dates, and set 'Date' as index.
 data_df = pd.read_csv('pvc_data.csv', dtype=str, encoding='utf-8')
-data_df['Date'] = data_df['Date'].apply(parse_portuguese_date)
+data_df['Date'] = parse_portuguese_dates(data_df['Date'])
 data_df.set_index('Date', inplace=True)
 
 # 2) Select "actual" columns, clean data, convert decimals and types, and forward-fill missing values.
 actual_columns = [col for col in data_df.columns if 'actual' in col.lower()]
-actual_data = data_df[actual_columns].replace('', np.nan).apply(lambda s: s.str.replace(',', '.')).astype(float).ffill()
+#    The decimal commas of all columns are replaced in one pass over a single NumPy text array (missing and
+#    empty cells become 'nan'), which is converted to floats in one step before the forward fill.
+#    Single precision (float32) is plenty for a plotted decomposition and halves the memory traffic;
+#    PyWavelets keeps the input dtype, so the coefficients and reconstructions stay float32 as well.
+actual_text = data_df[actual_columns].fillna('nan').to_numpy(dtype=str)
+actual_text[actual_text == ''] = 'nan'
+actual_data = pd.DataFrame(np.char.replace(actual_text, ',', '.').astype(np.float32),
+                           index=data_df.index, columns=actual_columns).ffill()
 
 # 3) Normalize each column to [0, 1] and aggregate into a single normalized time series.
-normalized_data = (actual_data - actual_data.min()) / (actual_data.max() - actual_data.min())
-aggregated_signal = normalized_data.mean(axis=1)
-aggregated_signal = (aggregated_signal - aggregated_signal.min()) / (aggregated_signal.max() - aggregated_signal.min())
-time_series = aggregated_signal.values
-time_index = aggregated_signal.index
+#    Each minimum is subtracted into a new array once, and that array is then divided in place by its own
+#    maximum (the range), so there are no separate max() - min() passes or temporary arrays. Missing values are skipped.
+normalized_data = actual_data.to_numpy() - np.nanmin(actual_data.to_numpy(), axis=0)
+normalized_data /= np.nanmax(normalized_data, axis=0)
+aggregated_signal = np.nanmean(normalized_data, axis=1)
+aggregated_signal -= np.nanmin(aggregated_signal)
+aggregated_signal /= np.nanmax(aggregated_signal)
+time_series = aggregated_signal
+time_index = actual_data.index
 
 # 4) Compute Discrete Wavelet Transform (DWT) up to 8 levels using the 'db4' wavelet.
 wavelet_name = 'db4'
-max_decomp_level = pywt.dwt_max_level(len(time_series), pywt.Wavelet(wavelet_name).dec_len)
+wavelet = pywt.Wavelet(wavelet_name)  # Built once and reused for the decomposition and every reconstruction.
+max_decomp_level = pywt.dwt_max_level(len(time_series), wavelet.dec_len)
 dwt_level = min(8, max_decomp_level)
-wavelet_coeffs = pywt.wavedec(time_series, wavelet_name, level=dwt_level)
+wavelet_coeffs = pywt.wavedec(time_series, wavelet, level=dwt_level)
+
+# 5) Reconstruct each detail component directly from its own coefficients with pywt.upcoef (no full inverse DWT
+#    over zeroed coefficient lists). upcoef keeps the full convolution at every level, so the samples matching the
+#    inverse DWT start after (filter length - 2) * (2**level - 1) extra samples.
+filter_length = wavelet.dec_len
+def reconstruct_band(part, coeffs, level):
+    start = (filter_length - 2) * (2 ** level - 1)
+    return pywt.upcoef(part, coeffs, wavelet, level=level)[start:start + len(time_series)]
 
-# 5) Reconstruct detail components by zeroing out all but one set of detail coefficients.
 detail_components = [
-    pywt.waverec(
-        [np.zeros_like(coef) if j != i else wavelet_coeffs[j] for j, coef in enumerate(wavelet_coeffs)],
-        wavelet_name
-    )[:len(time_series)]
+    reconstruct_band('d', wavelet_coeffs[i], len(wavelet_coeffs) - i)
     for i in range(1, len(wavelet_coeffs))
 ]
 detail_components.reverse()  # Reverse so that detail_components[0] is the highest frequency (D1)
 
 # Reconstruct the approximation (low-frequency component).
-approximation_coeffs = [wavelet_coeffs[0]] + [np.zeros_like(coef) for coef in wavelet_coeffs[1:]]
-approximation_signal = pywt.waverec(approximation_coeffs, wavelet_name)[:len(time_series)]
+approximation_signal = reconstruct_band('a', wavelet_coeffs[0], dwt_level) if dwt_level > 0 else wavelet_coeffs[0]
 
 # 6) Plot detail components, the approximation, and the original aggregated data.
 num_plots = dwt_level + 2  # details + approximation + original data
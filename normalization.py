@@ -3,18 +3,71 @@
 
 import os                    # Provides functions for interacting with the operating system (e.g., file paths, directory operations).
 import re                    # Provides regular expression operations for pattern matching and string manipulation.
+import functools             # Provides lru_cache, used to remember already parsed date strings.
 import pandas as pd          # Used for data manipulation and analysis via DataFrames.
+import numpy as np           # Used for the whole-table masks that find the trailing empty cells of every row.
 from dateutil.parser import parse  # Converts date strings into Python datetime objects.
-from itertools import dropwhile  # Provides a function to drop items from an iterable based on a condition.
+import datetime              # Date objects, which the pyarrow CSV reader returns for ISO date columns.
 from pathlib import Path     # Provides an object-oriented interface for file system paths.
+from concurrent.futures import ProcessPoolExecutor  # Normalizes several files in parallel worker processes.
+try:
+    import pyarrow as pa     # Arrow-backed columns, and Arrow's multithreaded CSV writer (see arrow_csv_writer).
+    import pyarrow.csv as pa_csv
+except ImportError:          # Without pyarrow, the files are read with NumPy dtypes and written with pandas' CSV writer.
+    pa = None
+
+# Write the normalized CSV files with Arrow's CSV writer (C++, multithreaded) instead of pandas' to_csv.
+# It is several times faster on large files, but its output differs from to_csv: the header and all text
+# values are quoted, whole-number floats lose their ".0" and times of day get nanosecond digits. Off by
+# default, so the files keep the format of to_csv; only takes effect when pyarrow is installed.
+arrow_csv_writer = False
+
+# Portuguese month abbreviations (as a single regular expression) and their English equivalents,
+# used to translate a date string (or a whole column of them) in one pass.
+PORTUGUESE_MONTH_PATTERN = re.compile(r'(jan|fev|mar|abr|mai|jun|jul|ago|set|out|nov|dez)\.')
+PORTUGUESE_TO_ENGLISH_MONTH = {
+    'jan': 'Jan', 'fev': 'Feb', 'mar': 'Mar', 'abr': 'Apr',
+    'mai': 'May', 'jun': 'Jun', 'jul': 'Jul', 'ago': 'Aug',
+    'set': 'Sep', 'out': 'Oct', 'nov': 'Nov', 'dez': 'Dec'
+}
+
+# The week format "KW <number>/<year>" (case-insensitive), matched at the start of a week string.
+KW_PATTERN = re.compile(r'KW\s*(\d+)/(\d+)', re.I)
+
+# The quarter number inside a quarter label (e.g. "Q3"), and the representative month of each quarter:
+# Q1 -> March (03), Q2 -> June (06), Q3 -> September (09), Q4 -> December (12)
+QUARTER_NUMBER_PATTERN = re.compile(r'(\d+)')
+QUARTER_TO_MONTH = {1: '03', 2: '06', 3: '09', 4: '12'}
+
+# Runs of characters that are forbidden in Windows file names, compiled once (see sanitize_filename).
+FORBIDDEN_FILENAME_PATTERN = re.compile(r'[\\/:*?"<>|]+')
+
+# ---------------------------------------------------------------------
+# Function: sanitize_filename
+# ---------------------------------------------------------------------
+def sanitize_filename(file_name):
+    """
+    Replaces every run of characters that are forbidden in Windows file names (\, /, :, *, ?, ", <, >, |)
+    with a single underscore (e.g. "A//B" becomes "A_B"). This is the one naming rule for the output files
+    of every pipeline step (diagrams, forecasts and MRA), so a product keeps the same name in all of them.
+    
+    Parameters:
+      file_name (str): The original file name.
+      
+    Returns:
+      str: A sanitized file name safe for saving.
+    """
+    return FORBIDDEN_FILENAME_PATTERN.sub('_', str(file_name))
 
 # ---------------------------------------------------------------------
 # Function: parse_portuguese_date
 # ---------------------------------------------------------------------
+@functools.lru_cache(maxsize=16384)
 def parse_portuguese_date(date_str):
     """
     Converts a date string that might use Portuguese month abbreviations into a standard datetime object.
     If the input is not a string or parsing fails, it returns pd.NaT (Not a Time).
+    Results are cached, as the same date strings repeat across the melted rows.
     
     Parameters:
       date_str (str): A date represented as a string.
@@ -25,15 +78,8 @@ def parse_portuguese_date(date_str):
     if not isinstance(date_str, str):
         # If the provided date_str is not a string, return pd.NaT to indicate an invalid date.
         return pd.NaT
-    # Create a mapping of Portuguese month abbreviations to their English equivalents.
-    month_map = {
-        'jan.': 'Jan', 'fev.': 'Feb', 'mar.': 'Mar', 'abr.': 'Apr',
-        'mai.': 'May', 'jun.': 'Jun', 'jul.': 'Jul', 'ago.': 'Aug',
-        'set.': 'Sep', 'out.': 'Oct', 'nov.': 'Nov', 'dez.': 'Dec'
-    }
-    # Loop through each Portuguese abbreviation and replace it with the English abbreviation.
-    for pt, en in month_map.items():
-        date_str = date_str.replace(pt, en)
+    # Replace every Portuguese abbreviation with the English abbreviation in a single regex pass.
+    date_str = PORTUGUESE_MONTH_PATTERN.sub(lambda match: PORTUGUESE_TO_ENGLISH_MONTH[match.group(1)], date_str)
     try:
         # Parse the date string into a datetime object.
         # 'dayfirst=True' tells the parser to interpret the first number as the day.
@@ -44,64 +90,139 @@ def parse_portuguese_date(date_str):
         return pd.NaT
 
 # ---------------------------------------------------------------------
-# Function: parse_kw_date
+# Function: parse_portuguese_dates
 # ---------------------------------------------------------------------
-def parse_kw_date(kw_str):
+def parse_portuguese_dates(date_series):
     """
-    Parses a week string in the format 'KW X/YYYY' into a datetime object representing the start of that ISO week.
+    Vectorized version of parse_portuguese_date for a whole column of dates.
+    ISO dates are converted in one call; the remaining values get their Portuguese month abbreviations
+    translated with plain string replacements and are converted (day first) in a second call. Only the
+    values that still cannot be parsed fall back to the per-value parse_portuguese_date. Each distinct
+    value is parsed once.
+    Unlike the per-value parser on its own, ISO dates keep their year-month-day order (2020-01-05 is 5 January,
+    not 1 May) and month-year strings (e.g. "jan. 2019") resolve to the 1st of the month, not today's day.
     
     Parameters:
-      kw_str (str): A string representing the week (e.g., "KW 2/2018").
+      date_series (Series): Dates as strings (possibly with Portuguese abbreviations).
       
     Returns:
-      datetime or pd.NaT: The parsed datetime for the week or pd.NaT if parsing fails.
+      Series: The parsed dates (datetime64), with NaT where parsing fails.
     """
-    # Use a regular expression to match the format "KW <number>/<year>".
-    if match := re.match(r'KW\s*(\d+)/(\d+)', str(kw_str).strip(), re.I):
-        # Construct a datetime using ISO week format: year, week number, and weekday (1 = Monday).
-        return pd.to_datetime(f"{match[2]}-W{match[1]}-1", format='%G-W%V-%u')
-    # If no match, return pd.NaT.
-    return pd.NaT
+    # Parse only the distinct values; 'codes' gives the position of every row's value among them
+    # (-1 for missing values).
+    codes, unique_dates = pd.factorize(date_series)
+    original_index, date_series = date_series.index, pd.Series(unique_dates)
+    # Only strings can be parsed; anything else (e.g. missing cells) becomes NaT, as in parse_portuguese_date.
+    # Date objects (the pyarrow CSV reader returns ISO date columns as such) are kept as they are.
+    is_text = date_series.map(type).eq(str)
+    is_date = date_series.map(lambda value: isinstance(value, datetime.date))
+    text_dates = date_series.where(is_text)
+    # Fast path: ISO formatted dates (and date objects).
+    parsed_dates = pd.to_datetime(date_series.where(is_text | is_date), format='ISO8601', errors='coerce')
+    unparsed = parsed_dates.isna() & is_text
+    if unparsed.any():
+        # Translate the month abbreviations of the remaining values and parse them together (day first).
+        # Each abbreviation is a plain (non-regex) replacement, which also runs as a C++ kernel on
+        # Arrow-backed strings (these do not support a regex with a replacement function).
+        translated = text_dates[unparsed]
+        for portuguese_month, english_month in PORTUGUESE_TO_ENGLISH_MONTH.items():
+            translated = translated.str.replace(portuguese_month + '.', english_month, regex=False)
+        parsed_dates[unparsed] = pd.to_datetime(translated, format='mixed', dayfirst=True, errors='coerce')
+        # Last resort for values that are still not understood: the fuzzy per-value parser.
+        unparsed = parsed_dates.isna() & is_text
+        if unparsed.any():
+            parsed_dates[unparsed] = pd.to_datetime(text_dates[unparsed].apply(parse_portuguese_date))
+    # Spread the parsed values back to every row; code -1 (a missing value) picks the NaT appended at the end.
+    parsed_dates = np.append(parsed_dates.to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT', 'ns'))
+    return pd.Series(parsed_dates[codes], index=original_index)
 
 # ---------------------------------------------------------------------
-# Function: clean_numeric
+# Function: parse_kw_dates
 # ---------------------------------------------------------------------
-def clean_numeric(val):
+def parse_kw_dates(kw_series):
     """
-    Converts a value to a numeric type.
-    It first converts the value to a string, replaces thousands separators ('.') with nothing,
-    replaces commas with periods (to standardize decimals), and removes any dashes.
+    Parses a whole column of week strings ('KW X/YYYY') into the start (Monday) of each ISO week.
+    The week and year are extracted with one regex pass and all dates are built with one
+    pd.to_datetime call. Each distinct week string is parsed once (the same week repeats for every product).
     
     Parameters:
-      val: A value that is expected to represent a number.
+      kw_series (Series): Week strings (e.g., "KW 2/2018").
       
     Returns:
-      numeric: The value converted to a number (or NaN if conversion fails).
+      Series: The start (Monday) of each ISO week (datetime64), with NaT where parsing fails.
     """
-    return pd.to_numeric(
-        str(val).replace('.', '').replace(',', '.').replace('–', ''),
+    # Parse only the distinct week strings; 'codes' gives the position of every row's string among them
+    # (-1 for missing values).
+    codes, unique_weeks = pd.factorize(kw_series)
+    # Extract the week number and the year, anchored at the start of the string after any leading whitespace
+    # (like re.match on the stripped string, without a separate strip pass).
+    week_and_year = pd.Series(unique_weeks).astype(str).str.extract(r'^\s*' + KW_PATTERN.pattern, flags=re.I)
+    # Build all "YYYY-WXX-1" strings at once and convert them using the ISO week format.
+    week_dates = pd.to_datetime(week_and_year[1] + '-W' + week_and_year[0] + '-1', format='%G-W%V-%u', errors='coerce')
+    # Spread the dates back to every row; code -1 (a missing value) picks the NaT appended at the end.
+    week_dates = np.append(week_dates.to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT', 'ns'))
+    return pd.Series(week_dates[codes], index=kw_series.index)
+
+# ---------------------------------------------------------------------
+# Function: clean_numeric_series
+# ---------------------------------------------------------------------
+def clean_numeric_series(values):
+    """
+    Converts a whole column of values to numbers: the text of every value has its thousands separators ('.')
+    removed, its decimal commas replaced with periods and its dashes removed. Each replacement is a single
+    pass over the column, followed by one pd.to_numeric call.
+    
+    Parameters:
+      values (Series): Values that are expected to represent numbers.
+      
+    Returns:
+      Series: The values converted to numbers (NaN where conversion fails).
+    """
+    # Arrow-backed strings are cleaned as they are (by Arrow's C++ kernels); anything else is converted
+    # to its text (str(value)) for every cell.
+    text = values if values.dtype == 'string[pyarrow]' else values.astype(str)
+    numbers = pd.to_numeric(
+        text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False).str.replace('–', '', regex=False),
         errors='coerce'  # If conversion fails, returns NaN.
     )
+    # Numbers parsed from Arrow strings (Arrow or nullable dtypes) get the NumPy dtype that pd.to_numeric gives
+    # for NumPy text (int64 when every value is a whole number, float64 with NaN otherwise), so the values do
+    # not depend on the backend.
+    if isinstance(numbers.dtype, pd.api.extensions.ExtensionDtype):
+        numbers = pa.array(numbers).to_pandas().set_axis(numbers.index)
+    return numbers
 
 # ---------------------------------------------------------------------
-# Function: trim_row
+# Function: trim_rows
 # ---------------------------------------------------------------------
-def trim_row(row):
+def trim_rows(df):
     """
-    Removes trailing empty cells from a list representing a row.
-    It uses dropwhile to remove values from the end that are None or empty (after stripping).
+    Converts every row of the DataFrame to a list with its trailing empty cells (None or empty
+    after stripping) removed. The empty cells are found with whole-table masks and the length
+    of every trimmed row with one NumPy pass, instead of scanning each row backwards in Python.
     
     Parameters:
-      row (list): A list of cell values.
+      df (DataFrame): The table whose rows should be trimmed.
       
     Returns:
-      list: The trimmed row with trailing empty cells removed.
+      list: One list of cell values per row, with trailing empty cells removed.
     """
-    # 'dropwhile' iterates from the end (using reversed(row)) until the condition is false.
-    trimmed = list(dropwhile(lambda v: v is None or (isinstance(v, str) and not v.strip()),
-                              reversed(row)))
-    # Reverse again to restore the original order.
-    return list(reversed(trimmed))
+    values = df.to_numpy(dtype=object)
+    if values.size == 0:
+        return [[] for _ in range(len(values))]
+    # Empty cells: None (but not NaN) or strings that are blank after stripping. Text can be held in
+    # object columns as well as in string columns (pandas 3's default str dtype or Arrow strings).
+    is_none = values == None
+    is_blank = np.column_stack([
+        df.iloc[:, col].str.strip().eq('').to_numpy(dtype=bool, na_value=False)
+        if pd.api.types.is_object_dtype(df.iloc[:, col]) or pd.api.types.is_string_dtype(df.iloc[:, col])
+        else np.zeros(len(df), dtype=bool)
+        for col in range(df.shape[1])
+    ])
+    is_filled = ~(is_none | is_blank)
+    # Position after the last filled cell of every row (0 for rows without any filled cell).
+    row_lengths = np.where(is_filled.any(axis=1), values.shape[1] - is_filled[:, ::-1].argmax(axis=1), 0)
+    return [row[:length] for row, length in zip(values.tolist(), row_lengths.tolist())]
 
 # ---------------------------------------------------------------------
 # Function: process_quarters
@@ -111,8 +232,8 @@ def process_quarters(df, product_name):
     Processes a DataFrame that contains quarterly data.
     
     Expects a DataFrame where the first column is a year and the remaining columns are quarter values.
-    It "melts" (un-pivots) the DataFrame, extracts the quarter number, maps it to a representative month,
-    and constructs a datetime (assuming the day is 15 for each quarter).
+    It un-pivots the DataFrame (in the same order as melt), extracts the quarter number, maps it to a
+    representative month, and constructs a datetime (assuming the day is 15 for each quarter).
     
     Parameters:
       df (DataFrame): The input DataFrame containing year and quarter data.
@@ -121,34 +242,76 @@ def process_quarters(df, product_name):
     Returns:
       DataFrame: A normalized DataFrame with columns: Date, Product, and Value.
     """
-    # Rename the first column to "Year" for clarity.
-    df = df.rename(columns={df.columns[0]: 'Year'})
-    # "Melt" the DataFrame: convert columns (quarters) into rows with a 'Quarter' column and a 'Value' column.
-    melted = df.melt(id_vars='Year', value_name='Value', var_name='Quarter')
-    # Extract the quarter number from the 'Quarter' column safely.
-    q_extract = melted['Quarter'].astype(str).str.extract(r'(\d+)')[0]
-    # Create a boolean mask for valid quarter numbers (non-empty and non-null).
-    valid = q_extract.notna() & q_extract.str.strip().ne('')
-    # Filter the melted DataFrame to keep only rows with a valid quarter number.
-    melted = melted[valid].copy()
-    # Convert the extracted quarter numbers to numeric values.
-    q_num = pd.to_numeric(q_extract[valid], errors='coerce')
-    # Define a mapping from quarter number to a representative month.
-    # Q1 -> March (03), Q2 -> June (06), Q3 -> September (09), Q4 -> December (12)
-    month_map = {1: '03', 2: '06', 3: '09', 4: '12'}
-    # Map the numeric quarter to the corresponding month using the mapping.
-    month = q_num.map(month_map)
-    # Construct a new 'Date' column by combining the Year, mapped Month, and a fixed day (15).
-    melted['Date'] = pd.to_datetime(
-        melted['Year'].astype(str) + '-' + month.fillna('03') + '-15',
-        errors='coerce'
-    )
-    # Assign the product name to every row, clean the numeric values, drop rows with missing Date or Value,
-    # and sort the DataFrame by Date. Then, select only the desired columns.
-    return (melted.assign(Product=product_name,
-                          Value=lambda d: d['Value'].apply(clean_numeric))
-                  .dropna(subset=['Date', 'Value'])
-                  .sort_values('Date')[['Date', 'Product', 'Value']])
+    # Un-pivot the DataFrame with NumPy instead of melt: the first column holds the years and every other
+    # column (quarter) becomes one run of rows, column by column, as melt does. The years are tiled once
+    # per quarter column and the values are read column by column (Fortran order) from a single array.
+    quarter_columns = pd.Series(df.columns[1:])
+    num_rows = len(df)
+    quarter_values = pd.Series(df.iloc[:, 1:].to_numpy().ravel(order='F'))
+    # Extract the quarter number of every quarter column once (instead of once per row) and create a mask for
+    # valid quarter numbers. A match is always a run of digits, so every extracted number is non-empty.
+    q_extract = quarter_columns.astype(str).str.extract(QUARTER_NUMBER_PATTERN)[0]
+    valid_columns = q_extract.notna()
+    # Convert the extracted quarter numbers to numeric values and map them to their representative
+    # months (QUARTER_TO_MONTH, defined once at module level).
+    month = pd.to_numeric(q_extract[valid_columns], errors='coerce').map(QUARTER_TO_MONTH).fillna('03')
+    # Repeat the mask for every row of its column.
+    valid = np.repeat(valid_columns.to_numpy(), num_rows)
+    # Build the dates from the Year, mapped Month, and a fixed day (15), and clean the numeric values.
+    # Both are kept as plain NumPy arrays, so no intermediate DataFrames are materialized.
+    # When every year is a plain four-digit year (within the range of datetime64[ns]), the dates are computed
+    # with NumPy date arithmetic (year + month offset + 14 days), with no strings built or parsed.
+    # Otherwise the "YYYY-MM-15" strings are parsed, which turns the years that are not understood into NaT.
+    year_text = df.iloc[:, 0].astype(object).map(str).to_numpy(dtype=object)
+    year_numbers = pd.to_numeric(year_text, errors='coerce')
+    if (pd.Series(year_text).str.fullmatch(r'\d{4}').all()
+            and ((year_numbers >= 1678) & (year_numbers <= 2261)).all()):
+        years = np.tile(year_numbers.astype(np.int64), len(month))
+        months = np.repeat(month.to_numpy(dtype=np.int64), num_rows)
+        dates = ((years - 1970).astype('datetime64[Y]') + (months - 1).astype('timedelta64[M]')
+                 + np.timedelta64(14, 'D')).astype('datetime64[ns]')
+    else:
+        dates = pd.to_datetime(
+            np.tile(year_text, len(month)) + '-' + np.repeat(month.to_numpy(dtype=object), num_rows) + '-15',
+            errors='coerce'
+        ).to_numpy()
+    values = clean_numeric_series(quarter_values[valid]).to_numpy()
+    # Keep the rows with a Date and a Value, build the normalized DataFrame once, and sort it by Date
+    # (stable, so ties keep their order). The product name is stored once as a category, with a
+    # one-byte code per row instead of a string reference per row. Categories cannot be null, so the
+    # name is taken as text (a missing name becomes 'nan', as in the row text of load_normalized).
+    has_data = ~np.isnat(dates) & ~np.isnan(values)
+    products = pd.Categorical.from_codes(np.zeros(has_data.sum(), dtype=np.int8), [str(product_name)])
+    return (pd.DataFrame({'Date': dates[has_data], 'Product': products, 'Value': values[has_data]})
+              .sort_values('Date', kind='stable'))
+
+# ---------------------------------------------------------------------
+# Function: read_csv_file
+# ---------------------------------------------------------------------
+def read_csv_file(path, **read_options):
+    """
+    Reads a CSV file with pandas' multithreaded pyarrow engine. If pyarrow is not installed
+    or cannot parse the file (e.g. rows with more fields than the header, or Arrow-backed columns
+    that share the same header name), the file is read with the default C engine instead.
+    Empty cells of text columns are NaN, as with the C engine (the pyarrow engine returns None
+    for them).
+    
+    Parameters:
+      path (Path): The CSV file.
+      **read_options: Further options for pd.read_csv (e.g. decimal, header).
+      
+    Returns:
+      DataFrame: The file contents.
+    """
+    try:
+        df = pd.read_csv(path, engine='pyarrow', **read_options)
+    except (ImportError, ValueError, NotImplementedError):
+        return pd.read_csv(path, **read_options)
+    # Replace the None cells column by column (by position, as unnamed header columns share the same name).
+    for position in np.flatnonzero((df.dtypes == object).to_numpy()):
+        column = df.iloc[:, position]
+        df.isetitem(position, column.where(column.notna(), np.nan))
+    return df
 
 # ---------------------------------------------------------------------
 # Function: load_normalized
@@ -176,9 +339,18 @@ def load_normalized(filepath):
     """
     # Create a Path object for the file.
     path = Path(filepath)
-    # Read the file based on its extension: Excel files or CSV files.
-    df = (pd.read_excel(path) if path.suffix in ['.xls', '.xlsx']
-          else pd.read_csv(path, decimal=','))
+    # Read the file based on its extension: Excel files or CSV files. When pyarrow is installed, the columns
+    # are Arrow-backed, so the text columns are Arrow strings and the string operations of the layouts
+    # below (replace, extract, strip) run as Arrow's C++ kernels instead of per-object Python calls.
+    arrow_backend = {'dtype_backend': 'pyarrow'} if pa is not None else {}
+    df = (pd.read_excel(path, **arrow_backend) if path.suffix in ['.xls', '.xlsx']
+          else read_csv_file(path, decimal=',', **arrow_backend))
+    # Numeric columns get the NumPy dtypes of the default backend (e.g. an integer column with empty cells
+    # becomes float64), so clean_numeric_series sees the same str() text of every value, with or without pyarrow.
+    # Only the text columns stay Arrow-backed.
+    for position in np.flatnonzero([isinstance(dtype, pd.ArrowDtype) and pd.api.types.is_numeric_dtype(dtype)
+                                    for dtype in df.dtypes]):
+        df.isetitem(position, pa.array(df.iloc[:, position]).to_pandas().set_axis(df.index))
     # Standardize column names to lower-case and strip extra spaces.
     cols_lower = [str(c).lower().strip() for c in df.columns]
     
@@ -186,25 +358,28 @@ def load_normalized(filepath):
     if 'date' in cols_lower:
         # Find the column that is identified as "date" (case-insensitive).
         date_col = df.columns[cols_lower.index('date')]
-        # Convert the date column using our custom parser, melt the DataFrame to long format,
-        # clean numeric values, drop rows with missing dates or values, rename the date column to "Date",
-        # and sort the DataFrame by Date.
-        return (df.assign(**{date_col: df[date_col].apply(parse_portuguese_date)})
+        # Convert the date column using our vectorized parser, melt the DataFrame to long format,
+        # clean numeric values, keep the rows with a date and a value (one mask), store the product names
+        # as a category, rename the date column to "Date", and sort the DataFrame by Date (stable, so ties keep their order).
+        return (df.assign(**{date_col: parse_portuguese_dates(df[date_col])})
                 .melt(id_vars=date_col, var_name='Product', value_name='Value')
-                .assign(Value=lambda d: d['Value'].apply(clean_numeric))
-                .dropna(subset=[date_col, 'Value'])
+                .assign(Value=lambda d: clean_numeric_series(d['Value']))
+                .loc[lambda d: d[date_col].notna() & d['Value'].notna()]
+                .astype({'Product': 'category'})
                 .rename(columns={date_col: 'Date'})
-                .sort_values('Date'))
+                .sort_values('Date', kind='stable'))
     
     # Layout 2: Week-based (KW) layout.
     elif cols_lower[0] == 'product' and any('kw' in c for c in cols_lower[1:]):
-        # Melt the DataFrame with 'Product' as the identifier, convert week strings to dates,
-        # clean numeric values, drop rows with missing dates or values, and sort by Date.
+        # Melt the DataFrame with 'Product' as the identifier, convert week strings to dates (vectorized),
+        # clean numeric values, keep the rows with a date and a value and only the desired columns
+        # in one selection, store the product names as a category, and sort by Date (stable, so ties keep their order).
         return (df.melt(id_vars='Product', var_name='Week', value_name='Value')
-                .assign(Date=lambda d: d['Week'].apply(parse_kw_date),
-                        Value=lambda d: d['Value'].apply(clean_numeric))
-                .dropna(subset=['Date', 'Value'])
-                .sort_values('Date')[['Date', 'Product', 'Value']])
+                .assign(Date=lambda d: parse_kw_dates(d['Week']),
+                        Value=lambda d: clean_numeric_series(d['Value']))
+                .loc[lambda d: d['Date'].notna() & d['Value'].notna(), ['Date', 'Product', 'Value']]
+                .astype({'Product': 'category'})
+                .sort_values('Date', kind='stable'))
     
     # Layout 3: Multi-block or simple Year/Quarter layout.
     try:
@@ -213,9 +388,15 @@ def load_normalized(filepath):
             # Re-read the file without headers since it's assumed to be in a multi-block format.
             df = (pd.read_excel(path, header=None)
                   if path.suffix in ['.xls', '.xlsx']
-                  else pd.read_csv(path, header=None))
-            # Convert each row to a list with trailing empty cells removed.
-            rows = [trim_row(r) for r in df.values.tolist()]
+                  else read_csv_file(path, header=None))
+            # Convert each row to a list with trailing empty cells removed (for all rows at once).
+            rows = trim_rows(df)
+            # The text of every row's first cell (stripped) and whether it is a year (numeric), for all rows at once.
+            # str() of every cell, as for the rows themselves (a missing cell becomes 'nan'; astype(str) keeps
+            # it missing under pandas 3).
+            first_cells = df.iloc[:, 0].astype(object).map(str)
+            first_texts = first_cells.str.strip().tolist()
+            first_is_year = first_cells.str.replace('.', '', regex=False).str.isdigit().tolist()
             normalized_blocks = []  # To store processed data blocks.
             i = 0
             # Loop through the rows.
@@ -225,8 +406,8 @@ def load_normalized(filepath):
                     i += 1
                     continue
                 # Determine the product title from the row if the first cell is not numeric.
-                if str(rows[i][0]).strip() and not str(rows[i][0]).replace('.', '').isdigit():
-                    product = str(rows[i][0]).strip()
+                if first_texts[i] and not first_is_year[i]:
+                    product = first_texts[i]
                     i += 1
                 else:
                     # If not, use the file's base name as the product name.
@@ -242,18 +423,19 @@ def load_normalized(filepath):
                 if not str(header[0]).strip():
                     header[0] = "Year"
                 i += 1
-                # Collect data rows where the first cell is numeric (indicating a year).
-                data_rows = []
-                while i < len(rows) and rows[i] and str(rows[i][0]).replace('.', '').isdigit():
-                    data_rows.append(rows[i])
+                # Collect the data rows where the first cell is numeric (indicating a year) as one slice.
+                first_data_row = i
+                while i < len(rows) and rows[i] and first_is_year[i]:
                     i += 1
+                data_rows = rows[first_data_row:i]
                 # If data rows were collected, convert them into a DataFrame and process the quarters.
                 if data_rows:
                     block_df = pd.DataFrame(data_rows, columns=header)
                     normalized_blocks.append(process_quarters(block_df, product))
-            # If any blocks were processed, concatenate them into one DataFrame.
+            # If any blocks were processed, concatenate them into one DataFrame
+            # (with a single category of all the block product names).
             if normalized_blocks:
-                return pd.concat(normalized_blocks, ignore_index=True)
+                return pd.concat(normalized_blocks, ignore_index=True).astype({'Product': 'category'})
             else:
                 # Fallback: process the original DataFrame as a simple Year/Quarter layout.
                 return process_quarters(df, path.stem)
@@ -265,33 +447,102 @@ def load_normalized(filepath):
         # If any error occurs during processing, raise a ValueError with details.
         raise ValueError(f"Unsupported file format: {filepath}. Error: {e}")
 
+# ---------------------------------------------------------------------
+# Function: write_csv_file
+# ---------------------------------------------------------------------
+def write_csv_file(df, path):
+    """
+    Writes a normalized DataFrame (Date, Product, Value) to a CSV file without the index.
+    pandas' to_csv is used unless arrow_csv_writer is set (and pyarrow is installed): then Arrow's CSV
+    writer (written in C++ and multithreaded) writes the file, with dates without a time of day written
+    as plain dates (YYYY-MM-DD), as pandas does.
+    
+    Parameters:
+      df (DataFrame): The normalized data.
+      path (Path): The output CSV file.
+    """
+    if pa is None or not arrow_csv_writer:
+        df.to_csv(path, index=False)
+        return
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Write the dates as dates (instead of timestamps) when none of them has a time of day.
+    dates = df['Date'].to_numpy()
+    if (dates == dates.astype('datetime64[D]')).all():
+        table = table.set_column(table.schema.get_field_index('Date'), 'Date', table['Date'].cast(pa.date32()))
+    pa_csv.write_csv(table, path)
+
+# ---------------------------------------------------------------------
+# Function: normalize_file
+# ---------------------------------------------------------------------
+def normalize_file(file, output_dir):
+    """
+    Loads and normalizes one file, then saves it as a new CSV file in the output folder
+    (with the suffix "_normalized.csv"). Runs in a worker process of process_folder.
+    
+    Parameters:
+      file (Path): The input file.
+      output_dir (Path): The folder where the normalized file will be saved (None: the file is not written).
+      
+    Returns:
+      DataFrame: The normalized DataFrame (Date, Product, Value), without the rows of the product 'nan'.
+    """
+    normalized = load_normalized(file)
+    if output_dir is not None:
+        write_csv_file(normalized, output_dir / f"{file.stem}_normalized.csv")
+    # Blocks without a product title get the product name 'nan'. The later steps read that name back from
+    # the CSV file as a missing value and skip its rows, so the returned DataFrame leaves them out as well
+    # (the later steps then give the same results for the DataFrame as for the file).
+    normalized = normalized[normalized['Product'].ne('nan')]
+    return normalized.assign(Product=normalized['Product'].cat.remove_unused_categories())
+
 # ---------------------------------------------------------------------
 # Function: process_folder
 # ---------------------------------------------------------------------
-def process_folder(input='data', output='normalized'):
+def process_folder(input='data', output='normalized', max_workers=None):
     """
     Processes all files (Excel or CSV) in the input folder and writes normalized CSV files to the output folder.
     
     Each file is read and normalized to have three columns: Date, Product, and Value.
     The normalized file is saved with a suffix "_normalized.csv".
+    The files are independent, so they are normalized in parallel worker processes.
+    The normalized DataFrames are also returned, so the later pipeline stages (diagram, mra, forecast)
+    can use them directly instead of reading the CSV files back from disk.
     
     Parameters:
       input (str): The folder containing input files.
-      output (str): The folder where normalized files will be saved.
+      output (str): The folder where normalized files will be saved (None: no files are written).
+      max_workers (int): Number of worker processes (default: one per CPU core).
+      
+    Returns:
+      dict: Maps the base name of each normalized file (e.g. "pvc_data_normalized") to its DataFrame.
     """
     # Create a Path object for the output folder and make the folder if it doesn't exist.
-    output_dir = Path(output)
-    output_dir.mkdir(exist_ok=True)
+    output_dir = None
+    if output is not None:
+        output_dir = Path(output)
+        output_dir.mkdir(exist_ok=True)
     
-    # Loop through all files in the input folder.
-    for file in Path(input).glob('*.*'):
-        # Process only files with extensions CSV, XLS, or XLSX.
-        if file.suffix.lower() not in {'.csv', '.xls', '.xlsx'}:
-            continue
-        try:
-            # Load and normalize the file, then save it as a new CSV file in the output folder.
-            load_normalized(file).to_csv(output_dir / f"{file.stem}_normalized.csv", index=False)
-            print(f"Processed: {file.name}")
-        except Exception as e:
-            # If an error occurs, print an error message.
-            print(f"Error processing {file.name}: {str(e)}")
+    # List the input folder in a single os.scandir pass, keeping only the files with extensions CSV, XLS, or XLSX.
+    input_files = []
+    if os.path.isdir(input):
+        with os.scandir(input) as folder_entries:
+            input_files = [Path(entry.path) for entry in folder_entries
+                           if os.path.splitext(entry.name)[1].lower() in {'.csv', '.xls', '.xlsx'} and entry.is_file()]
+
+    normalize_jobs = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Loop through all input files.
+        for file in input_files:
+            # Load, normalize and save the file in a worker process.
+            normalize_jobs[file] = executor.submit(normalize_file, file, output_dir)
+
+        # Wait for every file; result() re-raises any error that happened in a worker.
+        normalized_frames = {}
+        for file, job in normalize_jobs.items():
+            try:
+                normalized_frames[f"{file.stem}_normalized"] = job.result()
+                print(f"Processed: {file.name}")
+            except Exception as e:
+                # If an error occurs, print an error message.
+                print(f"Error processing {file.name}: {str(e)}")
+    return normalized_frames